@@ -1,12 +1,73 @@
-from bs4 import BeautifulSoup
+from lxml import etree
 import pandas as pd
+import numpy as np
 import requests
 import pickle
-import random
 import time
+import threading
+import os
+import gzip
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
 from sqlalchemy import *
 import sys
-from orderedset import *
+import sqlite3
+import traceback
+import argparse
+import contextlib
+import re
+import itertools
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# fetch settings: number of requests kept in flight and the token bucket refill rate (requests/second) and burst
+# allowed for any single host
+FETCH_WORKERS = 8
+HOST_RATE = 0.5
+HOST_BURST = 2
+FETCH_RETRIES = 3
+
+# parser processes, 0 parses in the main process
+PARSE_WORKERS = os.cpu_count() or 1
+
+# on disk page cache: location, total size cap (bytes) and age (seconds) after which entries are evicted
+CACHE_DIR = 'Scrape Results/page_cache'
+CACHE_MAX_BYTES = 4 * 1024 ** 3
+CACHE_MAX_AGE = 365 * 24 * 3600
+
+# scrape output: directory, games buffered before each flush and rows per part file before rotating to a new one
+RESULTS_DIR = 'Scrape Results'
+SINK_BATCH_GAMES = 200
+SINK_PART_ROWS = 250000
+
+# columnar export, one parquet dataset per table partitioned by season and home team
+PARQUET_DIR = 'Scrape Results/parquet'
+
+# indexed game store, every table of every game as an arrow ipc stream in one memory mapped file
+GAME_STORE_DIR = 'Scrape Results/game_store'
+
+# sql store, any sqlalchemy url works, sqlite runs without a server
+SQL_URL = 'sqlite:///Scrape Results/boxscores.db'
+
+# season schedule the boxscore urls are derived from
+SCHEDULE_PATH = 'excels/combined excels/seasons_excel.csv'
+BOXSCORE_URL = 'http://www.basketball-reference.com/boxscores/{0}.html'
+
+# job ledger recording the state of every boxscore url
+LEDGER_PATH = 'Scrape Results/jobs.db'
+
+# player totals per season and team, kept up to date as games are written
+ROLLUP_PATH = 'Scrape Results/player_rollup.db'
+
+# class / id of every table the extractors read, everything else on a page is skipped while parsing
+BOXSCORE_TABLES = ('four_factors', 'nav_table stats_table', 'sortable stats_table', 'margin_top small_text')
+PBP_TABLES = ('no_highlight stats_table',)
 # checks if the string can be converted into a float
 
 
@@ -18,20 +79,83 @@ def is_number(s):
         return False
 
 
+BASKETBALL_REFERENCE_TEAMS = {'TOR': 28, 'BOS': 2, 'BKN': 3, 'NYK': 20, 'PHI': 23, 'IND': 12, 'CHI': 5, 'CLE': 6,
+                              'DET': 9, 'MIL': 17, 'MIA': 16, 'WAS': 30, 'CHA': 4, 'ATL': 1, 'ORL': 22, 'OKC': 21,
+                              'POR': 25, 'MIN': 18, 'DEN': 8, 'UTA': 29, 'LAC': 13, 'GSW': 10, 'PHO': 24, 'SAC': 26,
+                              'LAL': 14, 'SAS': 27, 'HOU': 11, 'MEM': 15, 'DAL': 7, 'NOP': 19, 'NOH': 19, 'NOK': 19,
+                              'NJN': 3, 'CHO': 4, 'BRK': 3, 'CHH': 4, 'SEA': 21, 'VAN': 15, 'WSB': 30}
+
+
 def convert_name_to_team_id(name):
-    name_to_id = {'TOR': 28, 'BOS': 2, 'BKN': 3, 'NYK': 20, 'PHI': 23, 'IND': 12, 'CHI': 5, 'CLE': 6, 'DET': 9,
-                  'MIL': 17, 'MIA': 16, 'WAS': 30, 'CHA': 4, 'ATL': 1, 'ORL': 22, 'OKC': 21, 'POR': 25, 'MIN': 18,
-                  'DEN': 8, 'UTA': 29, 'LAC': 13, 'GSW': 10, 'PHO': 24, 'SAC': 26, 'LAL': 14, 'SAS': 27, 'HOU': 11,
-                  'MEM': 15, 'DAL': 7, 'NOP': 19, 'NOH': 19, 'NOK': 19, 'NJN': 3, 'CHO': 4}
-    return name_to_id[name]
+    return BASKETBALL_REFERENCE_TEAMS[name]
+
+
+# text of a node and everything inside it
+def node_text(node):
+    return ''.join(node.itertext())
+
+
+def has_class(node, class_):
+    return class_ in (node.get('class') or '').split()
+
+
+# lxml parser target that only builds element trees for the wanted tables, every other tag is dropped as the
+# document streams past so no tree is built for the rest of the page
+# the tables are indexed by class attribute and id as they close, so the page is only traversed once
+class TableCollector(object):
+    def __init__(self, wanted):
+        self.wanted = set(wanted)
+        self.index = {}
+        self.builder = None
+        self.depth = 0
+
+    def start(self, tag, attrib):
+        if self.builder is not None:
+            self.builder.start(tag, attrib)
+            if tag == 'table':
+                self.depth += 1
+        elif tag == 'table' and (attrib.get('class') in self.wanted or attrib.get('id') in self.wanted):
+            self.builder = etree.TreeBuilder()
+            self.builder.start(tag, attrib)
+            self.depth = 1
+
+    def end(self, tag):
+        if self.builder is not None:
+            self.builder.end(tag)
+            if tag == 'table':
+                self.depth -= 1
+                if self.depth == 0:
+                    table = self.builder.close()
+                    self.builder = None
+                    for key in set([table.get('class'), table.get('id')]):
+                        if key in self.wanted:
+                            self.index.setdefault(key, []).append(table)
+
+    def data(self, data):
+        if self.builder is not None:
+            self.builder.data(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        return self.index
+
+
+# parses only the wanted tables out of a page of html
+# returns a page index: dict of table class / id -> list of lxml table elements in page order
+def parse_page(html, wanted=BOXSCORE_TABLES + PBP_TABLES):
+    parser = etree.HTMLParser(target=TableCollector(wanted))
+    parser.feed(html)
+    return parser.close()
 
 
 # Converts a row of a html_table in HTML into a list
 def row_to_list(row):
     data_row = []
-    data = row.find_all('td')
+    data = row.findall('.//td')
     for d in data:
-        txt = d.text
+        txt = node_text(d)
         if is_number(txt):
             txt = float(txt)
         elif txt == '':
@@ -44,13 +168,13 @@ def row_to_list(row):
 
 def player_row_to_list(row):
     data_row = []
-    data = row.find_all('td')
+    data = row.findall('.//td')
     for d in data:
-        link = d.find_all('a')
+        link = d.findall('.//a')
         if link:
             txt = url_to_id(link[0].get('href'))
         else:
-            txt = d.text
+            txt = node_text(d)
         if is_number(txt):
             txt = float(txt)
         elif txt == '':
@@ -76,6 +200,57 @@ def boxscore_url_to_shotchart(url):
     return url[:insert_ind] + '/shot-chart' + url[insert_ind:]
 
 
+# pages a game can do without, older seasons have no shot chart page
+OPTIONAL_PAGES = ('shotchart',)
+
+
+# true for the 404 of a page basketball-reference doesn't have
+def missing_page(error):
+    response = getattr(error, 'response', None)
+    return isinstance(error, requests.HTTPError) and response is not None and response.status_code == 404
+
+
+# url of one of a game's pages ('boxscore', 'pbp' or 'shotchart') from its boxscore url
+def page_url(link, page):
+    if page == 'pbp':
+        return boxscore_url_to_play_by_play(link)
+    if page == 'shotchart':
+        return boxscore_url_to_shotchart(link)
+    if page == 'boxscore':
+        return link
+    raise ValueError('unknown page {0}'.format(page))
+
+
+# collects the rows of a table one column list per header entry and builds the DataFrame once at the end, instead of
+# copying the whole frame on every DataFrame.append
+# rows shorter than the header are padded with NaN like DataFrame.append did, data[i] is the column list for header[i]
+class RowAccumulator(object):
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.data = [[] for _ in self.columns]
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, row):
+        if len(row) > len(self.data):
+            raise ValueError('row has {0} values for {1} columns'.format(len(row), len(self.data)))
+        for col, value in zip(self.data, row):
+            col.append(value)
+        for col in self.data[len(row):]:
+            col.append(float('nan'))
+        self.length += 1
+
+    # dtypes is an optional dict of column name -> dtype applied while building the frame
+    def to_frame(self, dtypes=None):
+        frame = pd.DataFrame(dict((i, col) for i, col in enumerate(self.data)), index=range(self.length))
+        frame.columns = self.columns
+        if dtypes:
+            frame = frame.astype(dtypes)
+        return frame
+
+
 # Takes in a html_table in the form of HTML and returns a pandas dataframe
 
 def time_to_seconds(t):
@@ -86,25 +261,24 @@ def time_to_seconds(t):
 
 
 def get_player_boxscore_from_html_table(html_table):
-    frame = pd.DataFrame()
-    header = html_table.find_all('th', class_="tooltip")
+    header = [h for h in html_table.iter('th') if has_class(h, 'tooltip')]
     header_lst = []
     for h in header:
-        header_lst.append(h.text)
+        header_lst.append(node_text(h))
 
     header_lst[0] = 'player_id'
     header_lst.insert(0, 'game_id')
     header_lst.append('H/A')
-    rows = html_table.find_all('tr')
+    rows = html_table.iter('tr')
+    frame = RowAccumulator(header_lst)
 
     for r in rows:
         data_row = player_row_to_list(r)
         if data_row:
             data_row.insert(0, None)
             data_row.append(None)
-            frame = frame.append(pd.Series(data_row), ignore_index=True)
-    frame.columns = header_lst
-    return frame
+            frame.append(data_row)
+    return frame.to_frame()
 
 
 def convert_text_to_scores(txt):
@@ -127,6 +301,401 @@ def get_team_id(scores):
     return home, away
 
 
+#################################################################################################################
+#                                                                                                               #
+#                                           Metrics                                                             #
+#                                                                                                               #
+#################################################################################################################
+
+
+# stages a game goes through, in pipeline order. fetch is timed per page request, the rest per game
+STAGES = ('fetch', 'parse', 'refs', 'boxscore', 'four_factors', 'final_scores', 'game_length', 'pbp', 'shots',
+          'derived_boxscore', 'compare', 'stints', 'possessions')
+
+
+# adds the wall time of the block to timings[stage], timings is a dict of stage -> seconds and may be None
+@contextlib.contextmanager
+def timed(timings, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+# yields (item, seconds spent waiting for it) for every item of iterable
+def timed_iter(iterable):
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        yield item, time.perf_counter() - start
+
+
+# thread safe run totals plus one record per game
+# counters are keyed by name and labels, e.g. count('rows', 412, table='pbp'). stage times are the counters
+# stage_seconds / stage_calls labelled by stage. the totals can be written as prometheus text and the game records
+# as json lines (one object per game with its stage times, rows per table and final state)
+class Metrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.records = []
+
+    def count(self, name, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def add_time(self, stage, seconds):
+        self.count('stage_seconds', seconds, stage=stage)
+        self.count('stage_calls', 1, stage=stage)
+
+    # timings is the stage -> seconds dict filled while the game was parsed, tables the frames it produced
+    def add_game(self, game_id, timings, tables=None, state=None, fetch_wait=None):
+        for stage, seconds in timings.items():
+            self.add_time(stage, seconds)
+        rows = dict((name, len(frame)) for name, frame in (tables or {}).items() if frame is not None)
+        for name, n in rows.items():
+            self.count('rows', n, table=name)
+        self.count('games', 1, state=state)
+        record = {'game_id': game_id, 'state': state, 'stages': timings, 'rows': rows}
+        if fetch_wait is not None:
+            record['fetch_wait'] = fetch_wait
+        with self.lock:
+            self.records.append(record)
+
+    def get(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    # appends the game records collected so far to path and forgets them
+    def write_jsonl(self, path):
+        with self.lock:
+            records = self.records
+            self.records = []
+        with open(path, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+
+    def prometheus(self, prefix='bbref'):
+        with self.lock:
+            counters = sorted(self.counters.items())
+        lines = []
+        declared = set()
+        for (name, labels), value in counters:
+            metric = '{0}_{1}_total'.format(prefix, name)
+            if metric not in declared:
+                lines.append('# TYPE {0} counter'.format(metric))
+                declared.add(metric)
+            if labels:
+                metric += '{' + ','.join('{0}="{1}"'.format(k, v) for k, v in labels) + '}'
+            lines.append('{0} {1}'.format(metric, value))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+
+#################################################################################################################
+#                                                                                                               #
+#                                           Fetch layer                                                         #
+#                                                                                                               #
+#################################################################################################################
+
+
+# token bucket shared by every thread talking to one host, refills at rate tokens/second up to capacity
+class TokenBucket(object):
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    # blocks until a token is available and takes it
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# keeps one token bucket per host so each site gets its own request budget
+class HostRateLimiter(object):
+    def __init__(self, rate=HOST_RATE, capacity=HOST_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.capacity)
+                self.buckets[host] = bucket
+        bucket.acquire()
+
+
+_thread_state = threading.local()
+
+
+# requests sessions are not safe to share between threads, so every worker keeps its own
+def get_session():
+    session = getattr(_thread_state, 'session', None)
+    if session is None:
+        session = requests.Session()
+        _thread_state.session = session
+    return session
+
+
+# gzip compressed html cache keyed by the sha1 of the url, each entry has a .html.gz body and a .json with the
+# url and validators (ETag / Last-Modified) used to revalidate it
+# the body's mtime is bumped on every hit so eviction drops the least recently used pages first
+class PageCache(object):
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE, evict_every=500):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self.puts = 0
+        self.lock = threading.Lock()
+
+    def key(self, url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def paths(self, url):
+        key = self.key(url)
+        base = os.path.join(self.directory, key[:2], key)
+        return base + '.html.gz', base + '.json'
+
+    def __contains__(self, url):
+        return os.path.exists(self.paths(url)[1])
+
+    # returns (html, meta) for a cached url or None
+    def get(self, url):
+        body_path, meta_path = self.paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with gzip.open(body_path, 'rb') as f:
+                html = f.read().decode('utf-8')
+        except (IOError, OSError, ValueError):
+            return None
+        try:
+            os.utime(body_path, None)
+        except OSError:
+            pass
+        return html, meta
+
+    def put(self, url, html, headers=None):
+        body_path, meta_path = self.paths(url)
+        headers = headers or {}
+        meta = {'url': url, 'fetched': time.time(), 'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified')}
+        if not os.path.isdir(os.path.dirname(body_path)):
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        # write to temp files and rename so readers in other threads never see half written entries
+        tmp = '{0}.{1}.tmp'.format(body_path, threading.get_ident())
+        with gzip.open(tmp, 'wb', compresslevel=6) as f:
+            f.write(html.encode('utf-8'))
+        os.replace(tmp, body_path)
+        self.write_meta(meta_path, meta)
+        with self.lock:
+            self.puts += 1
+            evict = self.evict_every and self.puts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    # called after a 304 so the entry counts as freshly fetched
+    def refresh(self, url):
+        body_path, meta_path = self.paths(url)
+        cached = self.get(url)
+        if cached is not None:
+            meta = cached[1]
+            meta['fetched'] = time.time()
+            self.write_meta(meta_path, meta)
+
+    def write_meta(self, meta_path, meta):
+        tmp = '{0}.{1}.tmp'.format(meta_path, threading.get_ident())
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+    # drops entries fetched more than max_age seconds ago, then least recently used entries until the cache
+    # fits in max_bytes. returns the number of entries removed
+    def evict(self):
+        entries = []
+        total = 0
+        now = time.time()
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.html.gz'):
+                    continue
+                body_path = os.path.join(root, name)
+                meta_path = body_path[:-len('.html.gz')] + '.json'
+                try:
+                    body_stat = os.stat(body_path)
+                    fetched = os.stat(meta_path).st_mtime
+                except OSError:
+                    continue
+                entries.append((body_stat.st_mtime, fetched, body_stat.st_size, body_path, meta_path))
+                total += body_stat.st_size
+        removed = 0
+        entries.sort()
+        for used, fetched, size, body_path, meta_path in entries:
+            expired = self.max_age is not None and now - fetched > self.max_age
+            if not expired and (self.max_bytes is None or total <= self.max_bytes):
+                continue
+            for path in (meta_path, body_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+        return removed
+
+
+# downloads a page and returns its html, retrying on connection errors, 429 and 5xx responses
+# with a cache, cached pages are returned without touching the network unless revalidate is set, in which case a
+# conditional request is sent and a 304 reuses the cached copy. offline raises IOError for pages not in the cache
+def fetch_page(url, limiter=None, retries=FETCH_RETRIES, backoff=5.0, cache=None, offline=False, revalidate=False,
+               metrics=None):
+    cached = cache.get(url) if cache is not None else None
+    if cached is not None and (offline or not revalidate):
+        if metrics is not None:
+            metrics.count('cache_hits')
+        return cached[0]
+    if offline:
+        raise IOError('{0} is not in the page cache'.format(url))
+    headers = {}
+    if cached is not None:
+        if cached[1].get('etag'):
+            headers['If-None-Match'] = cached[1]['etag']
+        if cached[1].get('last_modified'):
+            headers['If-Modified-Since'] = cached[1]['last_modified']
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire(url)
+        try:
+            start = time.perf_counter()
+            r = get_session().get(url, timeout=30, headers=headers)
+            if metrics is not None:
+                metrics.add_time('fetch', time.perf_counter() - start)
+                metrics.count('bytes_downloaded', len(r.content))
+            if r.status_code == 304 and cached is not None:
+                cache.refresh(url)
+                return cached[0]
+            if r.status_code == 429 or r.status_code >= 500:
+                wait = r.headers.get('Retry-After')
+                if wait and is_number(wait):
+                    time.sleep(float(wait))
+                raise requests.HTTPError('{0} for {1}'.format(r.status_code, url), response=r)
+            r.raise_for_status()
+            if cache is not None:
+                cache.put(url, r.text, r.headers)
+            return r.text
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+            response = getattr(e, 'response', None)
+            if attempt == retries or (response is not None and 400 <= response.status_code < 500 and
+                                      response.status_code != 429):
+                raise
+            if metrics is not None:
+                metrics.count('fetch_retries')
+            time.sleep(backoff * (attempt + 1))
+
+
+# thread pool that keeps many page requests in flight while the rate limiter spaces them out per host
+# pass a PageCache to serve already downloaded pages from disk, offline=True never touches the network
+# pass a Metrics to count request time, bytes downloaded, retries and cache hits
+class PageFetcher(object):
+    def __init__(self, max_workers=FETCH_WORKERS, rate=HOST_RATE, burst=HOST_BURST, retries=FETCH_RETRIES,
+                 cache=None, offline=False, revalidate=False, metrics=None):
+        self.limiter = HostRateLimiter(rate, burst)
+        self.retries = retries
+        self.cache = cache
+        self.offline = offline
+        self.revalidate = revalidate
+        self.metrics = metrics
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, url):
+        return self.pool.submit(fetch_page, url, self.limiter, self.retries, cache=self.cache, offline=self.offline,
+                                revalidate=self.revalidate, metrics=self.metrics)
+
+    # starts the boxscore, play by play (and optionally shot chart) downloads for a game at the same time, or only
+    # the pages named in pages. returns a dict of futures keyed by page name
+    def submit_game(self, link, shotchart=False, pages=None):
+        if pages is None:
+            pages = ('boxscore', 'pbp', 'shotchart') if shotchart else ('boxscore', 'pbp')
+        return dict((page, self.submit(page_url(link, page))) for page in pages)
+
+    def fetch_game(self, link, shotchart=False, pages=None):
+        futures = self.submit_game(link, shotchart, pages)
+        return dict((k, f.result()) for k, f in futures.items())
+
+    # yields (link, pages) in input order, keeping up to window games downloading ahead of the consumer
+    # pages is a dict of page name -> html, or the exception raised while fetching the game. an OPTIONAL_PAGES
+    # page that can't be fetched doesn't fail the game, its exception is put in the dict in place of the html
+    def iter_games(self, links, shotchart=False, window=None, pages=None):
+        if window is None:
+            window = self.max_workers * 2
+        pending = []
+        links = iter(links)
+        for link in links:
+            pending.append((link, self.submit_game(link, shotchart, pages)))
+            if len(pending) >= window:
+                break
+        while pending:
+            link, futures = pending.pop(0)
+            try:
+                result = {}
+                for k, f in futures.items():
+                    try:
+                        result[k] = f.result()
+                    except Exception as e:
+                        if k not in OPTIONAL_PAGES:
+                            raise
+                        result[k] = e
+            except Exception as e:
+                result = e
+            for nxt in links:
+                pending.append((nxt, self.submit_game(nxt, shotchart, pages)))
+                break
+            yield link, result
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        if self.cache is not None and not self.offline:
+            self.cache.evict()
+
+
+_default_fetcher = None
+
+
+def get_default_fetcher():
+    global _default_fetcher
+    if _default_fetcher is None:
+        _default_fetcher = PageFetcher(cache=PageCache())
+    return _default_fetcher
+
+
 # ################################################################################################################
 #################################################################################################################
 #################################################################################################################
@@ -143,15 +712,13 @@ def get_team_id(scores):
 
 # scrapes the final score of the game and returns a pandas dataframe
 # returns in the  form of [Game id, Team id, Q1, Q2, Q3, Q4, OT, Total, #OT, H/A (home = true, away = false)]
-def get_final_scores(soup):
-    frame = pd.DataFrame()
-
-    total_scores = soup.find_all('table', class_="nav_table stats_table")[0]
-    header = total_scores.find_all('th', class_="align_right")
+def get_final_scores(page):
+    total_scores = page['nav_table stats_table'][0]
+    header = [h for h in total_scores.iter('th') if has_class(h, 'align_right')]
     header_lst = []
     num_ot = len(header) - 5
     for h in header:
-        header_lst.append(h.text)
+        header_lst.append(node_text(h))
     header_lst_tmp = [header_lst[x] for x in [0, 1, 2, 3, -1]]
     header_lst = header_lst_tmp
     header_lst.insert(4, 'OT')
@@ -160,7 +727,8 @@ def get_final_scores(soup):
     header_lst.insert(0, 'game_id')  # game_id is added at the next level
     header_lst.append('H/A')
 
-    rows = total_scores.find_all('tr')
+    rows = total_scores.iter('tr')
+    frame = RowAccumulator(header_lst)
 
     for ii, r in enumerate(rows):
         data_row = row_to_list(r)
@@ -181,27 +749,25 @@ def get_final_scores(soup):
             elif ii == 3:
                 data_row.append(1)
 
-            frame = frame.append(pd.Series(data_row), ignore_index=True)
-    frame.columns = header_lst
-    return frame
+            frame.append(data_row)
+    return frame.to_frame()
 
 
 # scrapes the four factors from the box score and returns a pandas dataframe
 # returns in the form of [game_id, Team id, Pace, efg%, TOv%, ORB%, FT/fga, ORtg, H/A (home = true, away = false)]
-def get_four_factors(soup):
-    frame = pd.DataFrame()
-
-    four_factors = soup.find_all('table', id="four_factors")[0]
-    header = four_factors.find_all('th')
+def get_four_factors(page):
+    four_factors = page['four_factors'][0]
+    header = four_factors.iter('th')
     header_lst = []
     for h in header:
-        if h.has_attr('tip'):
-            header_lst.append(h.text)
+        if h.get('tip') is not None:
+            header_lst.append(node_text(h))
     header_lst[0] = 'team_id'
     header_lst.insert(0, 'game_id')
     header_lst.append('H/A')
 
-    rows = four_factors.find_all('tr')
+    rows = four_factors.iter('tr')
+    frame = RowAccumulator(header_lst)
     for ii, r in enumerate(rows):
         data_row = row_to_list(r)
         if data_row:
@@ -211,9 +777,8 @@ def get_four_factors(soup):
                 data_row.append(0)
             elif ii == 3:
                 data_row.append(1)
-            frame = frame.append(pd.Series(data_row), ignore_index=True)
-    frame.columns = header_lst
-    return frame
+            frame.append(data_row)
+    return frame.to_frame()
 
 
 # scrapes the boxscore for individual player stats and Team Stats and returns 2 pandas dataframes
@@ -225,13 +790,13 @@ def get_four_factors(soup):
 # DRtg, H/A (home = true, away = false)]
 
 
-def get_boxscore_stats(soup):
-    html_tables = soup.find_all('table', class_="sortable stats_table")
-    home = convert_name_to_team_id(html_tables[2]['id'][:html_tables[2]['id'].find('_')])
+def get_boxscore_stats(page):
+    html_tables = page['sortable stats_table']
+    home = convert_name_to_team_id(html_tables[2].get('id')[:html_tables[2].get('id').find('_')])
     home_basic = get_player_boxscore_from_html_table(html_tables[2])
     home_advanced = get_player_boxscore_from_html_table(html_tables[3])
-    home_basic = home_basic.drop('H/A', 1)
-    home_advanced = home_advanced.drop(['game_id', 'MP'], 1)
+    home_basic = home_basic.drop('H/A', axis=1)
+    home_advanced = home_advanced.drop(['game_id', 'MP'], axis=1)
     home_boxscore = home_basic.merge(home_advanced, on='player_id')
     home_boxscore.loc[:, 'H/A'] = 1
 
@@ -241,11 +806,11 @@ def get_boxscore_stats(soup):
     home_team_boxscore['team_id'] = home
     home_boxscore.insert(1, 'team_id', home)
 
-    away = convert_name_to_team_id(html_tables[0]['id'][:html_tables[0]['id'].find('_')])
+    away = convert_name_to_team_id(html_tables[0].get('id')[:html_tables[0].get('id').find('_')])
     away_basic = get_player_boxscore_from_html_table(html_tables[0])
     away_advanced = get_player_boxscore_from_html_table(html_tables[1])
-    away_basic = away_basic.drop('H/A', 1)
-    away_advanced = away_advanced.drop(['game_id', 'MP'], 1)
+    away_basic = away_basic.drop('H/A', axis=1)
+    away_advanced = away_advanced.drop(['game_id', 'MP'], axis=1)
     away_boxscore = away_basic.merge(away_advanced, on='player_id')
     away_boxscore.loc[:, 'H/A'] = 0
 
@@ -255,29 +820,109 @@ def get_boxscore_stats(soup):
     away_team_boxscore['team_id'] = away
     away_boxscore.insert(1, 'team_id', away)
 
-    team_boxscore = home_team_boxscore.append(away_team_boxscore, ignore_index=True)
-    player_boxscore = home_boxscore.append(away_boxscore, ignore_index=True)
+    team_boxscore = pd.concat([home_team_boxscore, away_team_boxscore], ignore_index=True)
+    player_boxscore = pd.concat([home_boxscore, away_boxscore], ignore_index=True)
 
     return player_boxscore, team_boxscore
 
 
 # scrapes the length of the game and returns a time object
-def get_game_length(soup):
-    frame = pd.DataFrame()
+def get_game_length(page):
     try:
-        html_table = soup.find_all('table', class_='margin_top small_text')[0]
-        row = html_table.find_all('tr')[2]
-        row_data = row.find_all('td')
-        length = row_data[1].text
+        html_table = page['margin_top small_text'][0]
+        row = html_table.findall('.//tr')[2]
+        row_data = row.findall('.//td')
+        length = node_text(row_data[1])
     except:
         length = 0
-    frame = frame.append(pd.Series([None, length]), ignore_index=True)
-    frame.columns = ['game_id', 'GameLength']
-    return frame
+    frame = RowAccumulator(['game_id', 'GameLength'])
+    frame.append([None, length])
+    return frame.to_frame()
+
+
+# play classification tables, each one is tried top to bottom and the first keyword found in a play's
+# description wins, so order matters (e.g. 'Double technical foul' must come before 'foul')
+PERIOD_RULES = (('Start of', 'start'), ('End of', 'end of period'), ('Jump', 'jump'), ('End', 'end'))
+EVENT_RULES = (('misses', 'miss'), ('makes', 'make'), ('Defensive rebound', 'Defensive rebound'),
+               ('Offensive rebound', 'Offensive rebound'), ('Turnover by', 'turnover'), ('Delay tech', 'delay'),
+               ('Double technical foul', 'double technical'), ('foul', 'foul'), ('timeout', 'timeout'),
+               ('Defensive three seconds', '3 seconds'), ('enters the game', 'substitution'))
+SHOT_RULES = (('3-pt', '3pt'), ('2-pt', '2pt'), ('free throw', 'ft'))
+FOUL_RULES = (('Offensive', 'Offensive'), ('Technical', 'Technical'), ('Double', 'Double foul'),
+              ('Shooting', 'Shooting'), ('Personal', 'Personal'), ('Loose ball', 'Loose ball'))
+SHOT_POINTS = {('make', '3pt'): 3, ('make', '2pt'): 2, ('make', 'ft'): 1}
+
+
+# returns the value of the first rule whose keyword is in text, None if no rule matches
+def match_rule(text, rules):
+    for keyword, value in rules:
+        if keyword in text:
+            return value
+    return None
+
+
+# classifies a play description in one pass over the rule tables
+# returns (event, kind) where kind is the shot type for makes/misses and the foul reason for fouls
+def classify_event(details):
+    event = match_rule(details, EVENT_RULES)
+    if event == 'miss' or event == 'make':
+        return event, match_rule(details, SHOT_RULES)
+    if event == 'foul':
+        return event, match_rule(details, FOUL_RULES)
+    return event, None
+
+
+# the unique values of a in their original order, leaving out everything in b
+def ordered_difference(a, b):
+    b = set(b)
+    return [x for x in dict.fromkeys(a) if x not in b]
+
+
+# lineup corrections for the period being scraped
+# a player who was on the court without being subbed in is only noticed once he shows up in a play (or the period
+# ends), then his lineup column has to change for every row of the period so far. a correction always covers the
+# period from its first row up to the current one, so only the latest (player, end row) per column is kept and the
+# column is written once when the period closes instead of on every correction
+class LineupPatches(object):
+    def __init__(self, frame):
+        self.frame = frame
+        self.start = 0
+        self.pending = {}
+
+    # value of lineup column ind in row once the pending corrections are applied
+    def get(self, ind, row):
+        if ind in self.pending:
+            player, end = self.pending[ind]
+            if self.start <= row < end:
+                return player
+        return self.frame.data[ind][row]
+
+    # lineup column among first..first + 4 that held player in the first row of the period (the last one if none did)
+    def find(self, player, first):
+        if self.start >= len(self.frame):
+            raise IndexError('no rows scraped for the period yet')
+        for ind in range(first, first + 5):
+            if player == self.get(ind, self.start):
+                break
+        return ind
+
+    # puts player in lineup column ind for every row of the period so far
+    def patch(self, ind, player):
+        self.pending[ind] = (player, len(self.frame))
+
+    def apply(self):
+        for ind, (player, end) in self.pending.items():
+            self.frame.data[ind][self.start:end] = [player] * (end - self.start)
+        self.pending = {}
+
+    # applies the corrections of the finished period, rows appended from here on belong to the next one
+    def new_period(self):
+        self.apply()
+        self.start = len(self.frame)
 
 
 # scrapes the play by play data and returns a pandas dataframe
-# input is beautifulsoup soup object, and an array of starters
+# input is the page index of the play by play page, and an array of starters
 # returns in the form of [game_id, play_id (event#), Period (Q), Time Remaining, Time Elapsed, Play Length, 
 # home team_id, away team_id, home_score, away_score, home1 player_id, home2 player_id, 
 # home3 player_id, home4_player_id, home5 player_id,
@@ -287,13 +932,12 @@ def get_game_length(soup):
 # NOTE Time is stored in seconds, start of quarter = 720.0
 # Event Types: ORb, Drb, Stl, Ast, Miss, Make, Blk, Jump, Foul, Ft, Turnover, Sub, Tech, Timeout, Kick
 
-def get_play_by_play(soup, starters, home_id, away_id):
+def get_play_by_play(page, starters, home_id, away_id):
     # html_table class_ = "no_highlight stats_html_table"
     # col 0 = time remaining in quarter
     # col 1 = away team action
     # col 2 = home team action
     # col 3 = home team action
-    frame = pd.DataFrame()
     ind = None
     # initialize row
     game_id = None
@@ -347,40 +991,44 @@ def get_play_by_play(soup, starters, home_id, away_id):
               'player_team_id', 'event_type', 'player_id', 'Opponent_id', 'Assist', 'Block', 'Steal', 'PTS', 'Result',
               'home_jump', 'away_jump', 'Possession', 'sub_in', 'sub_out', 'ft_num', 'ft_total', 'draw foul', 'foul',
               'reason', 'details']
+    frame = RowAccumulator(header)
+    lineups = LineupPatches(frame)
     # start scraping
-    html_table = soup.find_all('table', class_='no_highlight stats_table')[0]
-    rows = html_table.find_all('tr')
+    html_table = page['no_highlight stats_table'][0]
+    rows = html_table.iter('tr')
     # check for Quarter:
     for r in rows:
-        data = r.find_all('td')
+        data = r.findall('.//td')
         if data:
-            time_remaining = time_to_seconds(data[0].text)
+            time_remaining = time_to_seconds(node_text(data[0]))
             if len(data) == 2:
+                text = node_text(data[1])
+                event = match_rule(text, PERIOD_RULES)
                 # Start of period
-                if 'Start of' in data[1].text:
+                if event == 'start':
                     event_type = 'Start period'
                     period += 1
+                    lineups.new_period()
                     if period > 4:
                         period_length = 300.0
                         last_play = 300.0
                     else:
                         period_length = 720.0
                         last_play = 720.0
-                    details = data[1].text
+                    details = text
 
                     home_players_seen = []
                     away_players_seen = []
 
 
                 # Jump Ball
-                elif 'End of' in data[1].text:
+                elif event == 'end of period':
 
                     if period > 0:
-                        frame_period = frame[frame[2] == period]
-                        home_insert_tmp = list(OrderedSet(home_players_seen) - OrderedSet(home_players))
-                        home_to_replace = list(OrderedSet(home_players) - OrderedSet(home_players_seen))
-                        away_insert_tmp = list(OrderedSet(away_players_seen) - OrderedSet(away_players))
-                        away_to_replace = list(OrderedSet(away_players) - OrderedSet(away_players_seen))
+                        home_insert_tmp = ordered_difference(home_players_seen, home_players)
+                        home_to_replace = ordered_difference(home_players, home_players_seen)
+                        away_insert_tmp = ordered_difference(away_players_seen, away_players)
+                        away_to_replace = ordered_difference(away_players, away_players_seen)
 
                         home_insert = [x for x in home_insert_tmp if x is not None]
                         away_insert = [x for x in away_insert_tmp if x is not None]
@@ -388,35 +1036,29 @@ def get_play_by_play(soup, starters, home_id, away_id):
                         if home_to_replace and home_insert:
                             for i, p in enumerate(home_insert):
                                 player_to_replace = home_to_replace[i]
-                                for ind in range(10, 15):
-                                    if player_to_replace == frame_period.iloc[0, ind]:
-                                        print('ind: ', ind)
-                                        break
-                                ind2 = list(frame_period.index)
-                                frame.loc[ind2, ind] = p
+                                ind = lineups.find(player_to_replace, 10)
+                                print('ind: ', ind)
+                                lineups.patch(ind, p)
                                 home_players[home_players.index(player_to_replace)] = p
                         if away_to_replace and away_insert:
                             for i, p in enumerate(away_insert):
                                 player_to_replace = away_to_replace[i]
-                                for ind in range(15, 20):
-                                    if player_to_replace == frame_period.iloc[0, ind]:
-                                        break
-                                ind2 = list(frame_period.index)
-                                frame.loc[ind2, ind] = p
+                                ind = lineups.find(player_to_replace, 15)
+                                lineups.patch(ind, p)
                                 away_players[away_players.index(player_to_replace)] = p
                         home_players_seen = []
                         away_players_seen = []
 
-                elif 'Jump' in data[1].text:
+                elif event == 'jump':
                     event_type = 'Jump'
-                    links = data[1].find_all('a')
+                    links = data[1].findall('.//a')
                     if len(links) == 3:
-                        home_jump = url_to_id(links[0]['href'])
-                        away_jump = url_to_id(links[1]['href'])
-                        possession = url_to_id(links[2]['href'])
+                        home_jump = url_to_id(links[0].get('href'))
+                        away_jump = url_to_id(links[1].get('href'))
+                        possession = url_to_id(links[2].get('href'))
                     elif len(links) == 2:
-                        home_jump = url_to_id(links[0]['href'])
-                        away_jump = url_to_id(links[1]['href'])
+                        home_jump = url_to_id(links[0].get('href'))
+                        away_jump = url_to_id(links[1].get('href'))
 
                     # check for players seen for change of quarter substitutions
                     if home_jump not in home_players_seen:
@@ -424,38 +1066,34 @@ def get_play_by_play(soup, starters, home_id, away_id):
                     if away_jump not in away_players_seen:
                         away_players_seen.append(away_jump)
 
-                    details = data[1].text
-                elif 'End' in data[1].text:
+                    details = text
+                elif event == 'end':
                     event_type = 'End period'
-                    details = data[1].text
+                    details = text
             elif len(data) == 6:
-                if len(data[1].text) > 1:
-                    details = data[1].text
+                details = node_text(data[1])
+                if len(details) > 1:
                     play_team_id = away_id
                     ind = 1
                 else:
-                    details = data[5].text
+                    details = node_text(data[5])
                     play_team_id = home_id
                     ind = 5
+                links = data[ind].findall('.//a')
+                event, kind = classify_event(details)
                 # Event Types: ORb, Drb, Miss, Make, Jump, Foul, Ft, Turnover, Sub, Tech, Timeout, Kick
-                if 'misses' in details:
-                    links = data[ind].find_all('a')
-                    player = url_to_id(links[0]['href'])
+                if event == 'miss':
+                    player = url_to_id(links[0].get('href'))
                     result = 'miss'
                     if len(links) == 2:
-                        block = url_to_id(links[1]['href'])
-                    if '3-pt' in details:
-                        pts = 0
-                        event_type = '3pt'
-                    elif '2-pt' in details:
-                        pts = 0
-                        event_type = '2pt'
-                    elif 'free throw' in details:
+                        block = url_to_id(links[1].get('href'))
+                    if kind is not None:
                         pts = 0
+                        event_type = kind
+                    if kind == 'ft':
                         ft_num_info = details[details.rfind('of') - 2:]
                         ft_num = ft_num_info[0]
                         ft_total = ft_num_info[-1]
-                        event_type = 'ft'
 
                     # check for players seen for change of quarter substitutions
                     if ind == 5:
@@ -471,20 +1109,15 @@ def get_play_by_play(soup, starters, home_id, away_id):
                             if block not in home_players_seen:
                                 home_players_seen.append(block)
 
-                elif 'makes' in details:
-                    links = data[ind].find_all('a')
-                    player = url_to_id(links[0]['href'])
+                elif event == 'make':
+                    player = url_to_id(links[0].get('href'))
                     result = 'make'
                     if len(links) == 2:
-                        assist = url_to_id(links[1]['href'])
-                    if '3-pt' in details:
-                        pts = 3
-                        event_type = '3pt'
-                    elif '2-pt' in details:
-                        pts = 2
-                        event_type = '2pt'
-                    elif 'free throw' in details:
-                        pts = 1
+                        assist = url_to_id(links[1].get('href'))
+                    if kind is not None:
+                        pts = SHOT_POINTS[event, kind]
+                        event_type = kind
+                    if kind == 'ft':
                         if 'technical' not in details:
                             ft_num_info = details[details.rfind('of') - 2:]
                             ft_num = ft_num_info[0]
@@ -492,7 +1125,6 @@ def get_play_by_play(soup, starters, home_id, away_id):
                         else:
                             ft_num = 1
                             ft_total = 1
-                        event_type = 'ft'
 
                     # check for players seen for change of quarter substitutions
                     if ind == 5:
@@ -508,11 +1140,11 @@ def get_play_by_play(soup, starters, home_id, away_id):
                             if assist not in away_players_seen:
                                 away_players_seen.append(assist)
 
-                elif 'Defensive rebound' in details:
+                elif event == 'Defensive rebound':
                     if 'Team' in details:
                         player = play_team_id
                     else:
-                        player = url_to_id(data[ind].find_all('a')[0]['href'])
+                        player = url_to_id(links[0].get('href'))
                         # check for players seen for change of quarter substitutions
                         if ind == 5:
                             if player not in home_players_seen:
@@ -523,11 +1155,11 @@ def get_play_by_play(soup, starters, home_id, away_id):
 
                     event_type = 'Defensive rebound'
 
-                elif 'Offensive rebound' in details:
+                elif event == 'Offensive rebound':
                     if 'Team' in details:
                         player = play_team_id
                     else:
-                        player = url_to_id(data[ind].find_all('a')[0]['href'])
+                        player = url_to_id(links[0].get('href'))
 
                         # check for players seen for change of quarter substitutions
                         if ind == 5:
@@ -539,11 +1171,11 @@ def get_play_by_play(soup, starters, home_id, away_id):
 
                     event_type = 'Offensive rebound'
 
-                elif 'Turnover by' in details:
+                elif event == 'turnover':
                     if 'Team' in details:
                         player = play_team_id
                     else:
-                        player = url_to_id(data[ind].find_all('a')[0]['href'])
+                        player = url_to_id(links[0].get('href'))
                         # check for players seen for change of quarter substitutions
                         if ind == 5:
                             if player not in home_players_seen:
@@ -554,7 +1186,7 @@ def get_play_by_play(soup, starters, home_id, away_id):
 
                     if 'steal' in details:
                         event_type = 'turnover'
-                        steal = url_to_id(data[ind].find_all('a')[1]['href'])
+                        steal = url_to_id(links[1].get('href'))
                         # check for players seen for change of quarter substitutions
                         if ind == 1:
                             if steal not in home_players_seen:
@@ -566,24 +1198,24 @@ def get_play_by_play(soup, starters, home_id, away_id):
                         event_type = 'turnover'
                     reason = details[details.find('(') + 1:-1]
 
-                elif 'Delay tech' in details:
+                elif event == 'delay':
                     event_type = 'turnover'
                     player = play_team_id
 
-                elif "Double technical foul" in details:
+                elif event == 'double technical':
                     event_type = "foul"
                     reason = 'Technical'
-                    if len(data[ind].find_all('a')) > 0:
-                        foul = url_to_id(data[ind].find_all('a')[0]['href'])
+                    if len(links) > 0:
+                        foul = url_to_id(links[0].get('href'))
                     else:
                         foul = None
-                    if len(data[ind].find_all('a')) > 1:
-                        draw_foul = url_to_id(data[ind].find_all('a')[1]['href'])
+                    if len(links) > 1:
+                        draw_foul = url_to_id(links[1].get('href'))
                     else:
                         draw_foul = None
                     player = foul
 
-                elif 'foul' in details:
+                elif event == 'foul':
                     event_type = 'foul'
                     if 'Technical foul by Team' in details:
                         player = play_team_id
@@ -593,19 +1225,19 @@ def get_play_by_play(soup, starters, home_id, away_id):
                         else:
                             play_team_id = home_id
 
-                        if len(data[ind].find_all('a')) > 0:
-                            foul = url_to_id(data[ind].find_all('a')[0]['href'])
+                        if len(links) > 0:
+                            foul = url_to_id(links[0].get('href'))
                         else:
                             foul = None
-                        if len(data[ind].find_all('a')) > 1:
-                            draw_foul = url_to_id(data[ind].find_all('a')[1]['href'])
+                        if len(links) > 1:
+                            draw_foul = url_to_id(links[1].get('href'))
                         else:
                             draw_foul = None
 
                         player = foul
 
-                    if 'Offensive' in details:
-                        reason = 'Offensive'
+                    if kind == 'Offensive':
+                        reason = kind
 
                         if ind == 1:
                             if draw_foul and (draw_foul not in home_players_seen):
@@ -618,11 +1250,11 @@ def get_play_by_play(soup, starters, home_id, away_id):
                             if foul and (foul not in home_players_seen):
                                 home_players_seen.append(foul)
 
-                    elif 'Technical' in details:
-                        reason = 'Technical'
+                    elif kind == 'Technical':
+                        reason = kind
 
-                    elif 'Double' in details:
-                        reason = 'Double foul'
+                    elif kind == 'Double foul':
+                        reason = kind
 
                         if ind == 1:
                             if draw_foul and (draw_foul not in home_players_seen):
@@ -635,12 +1267,8 @@ def get_play_by_play(soup, starters, home_id, away_id):
                             if foul and (foul not in home_players_seen):
                                 home_players_seen.append(foul)
                     else:
-                        if 'Shooting' in details:
-                            reason = 'Shooting'
-                        elif 'Personal' in details:
-                            reason = 'Personal'
-                        elif 'Loose ball' in details:
-                            reason = 'Loose ball'
+                        if kind is not None:
+                            reason = kind
 
                         if ind == 5:
                             if draw_foul and (draw_foul not in home_players_seen):
@@ -653,15 +1281,15 @@ def get_play_by_play(soup, starters, home_id, away_id):
                             if foul and (foul not in home_players_seen):
                                 home_players_seen.append(foul)
 
-                elif 'timeout' in details:
+                elif event == 'timeout':
                     event_type = 'timeout'
                     if ind == 5:
                         player = home_id
                     elif ind == 1:
                         player = away_id
 
-                elif 'Defensive three seconds' in details:
-                    player = url_to_id(data[ind].find_all('a')[0]['href'])
+                elif event == '3 seconds':
+                    player = url_to_id(links[0].get('href'))
                     event_type = '3 seconds'
 
                     if ind == 5:
@@ -671,11 +1299,10 @@ def get_play_by_play(soup, starters, home_id, away_id):
                         if player not in home_players_seen:
                             home_players_seen.append(player)
 
-                elif 'enters the game' in details:
-                    links = data[ind].find_all('a')
-                    player = url_to_id(links[0]['href'])
+                elif event == 'substitution':
+                    player = url_to_id(links[0].get('href'))
                     sub_in = player
-                    sub_out = url_to_id(links[1]['href'])
+                    sub_out = url_to_id(links[1].get('href'))
                     event_type = 'substitution'
                     if ind == 1:
                         if sub_out not in away_players_seen:
@@ -684,27 +1311,18 @@ def get_play_by_play(soup, starters, home_id, away_id):
                             if None in away_players:
                                 player_insert = None
                             else:
-                                removable_players = OrderedSet(away_players) - OrderedSet(away_players_seen)
-                                player_insert = list(removable_players)[0]
-                            frame_period = frame[frame[2] == period]
-                            for ind in range(15, 20):
-                                if player_insert == frame_period.iloc[0, ind]:
-                                    break
-                            ind2 = list(frame_period.index)
-                            frame.loc[ind2, ind] = sub_out
+                                player_insert = ordered_difference(away_players, away_players_seen)[0]
+                            ind = lineups.find(player_insert, 15)
+                            lineups.patch(ind, sub_out)
                             away_players[ind - 15] = sub_out
                         if sub_in in away_players:
-                            removable_players = OrderedSet(away_players_seen) - OrderedSet(away_players)
+                            removable_players = ordered_difference(away_players_seen, away_players)
                             if removable_players:
-                                player_insert = list(removable_players)[0]
+                                player_insert = removable_players[0]
                             else:
                                 player_insert = None
-                            frame_period = frame[frame[2] == period]
-                            for ind in range(15, 20):
-                                if sub_in == frame_period.iloc[0, ind]:
-                                    break
-                            ind2 = list(frame_period.index)
-                            frame.loc[ind2, ind] = player_insert
+                            ind = lineups.find(sub_in, 15)
+                            lineups.patch(ind, player_insert)
                             away_players[ind - 15] = player_insert
                         away_sub_out.append(sub_out)
                         away_players[away_players.index(sub_out)] = sub_in
@@ -723,32 +1341,23 @@ def get_play_by_play(soup, starters, home_id, away_id):
                             if None in home_players:
                                 player_insert = None
                             else:
-                                removable_players = OrderedSet(home_players) - OrderedSet(home_players_seen)
-                                player_insert = list(removable_players)[0]
-                            frame_period = frame[frame[2] == period]
-                            for ind in range(10, 15):
-                                if player_insert == frame_period.iloc[0, ind]:
-                                    break
-                            ind2 = list(frame_period.index)
-                            frame.loc[ind2, ind] = sub_out
+                                player_insert = ordered_difference(home_players, home_players_seen)[0]
+                            ind = lineups.find(player_insert, 10)
+                            lineups.patch(ind, sub_out)
                             home_players[ind - 10] = sub_out
                         if sub_in in home_players:
-                            removable_players = OrderedSet(home_players_seen) - OrderedSet(home_players)
+                            removable_players = ordered_difference(home_players_seen, home_players)
                             if removable_players:
-                                player_insert = list(removable_players)[0]
+                                player_insert = removable_players[0]
                             else:
                                 player_insert = None
-                            frame_period = frame[frame[2] == period]
-                            for ind in range(10, 15):
-                                if sub_in == frame_period.iloc[0, ind]:
-                                    break
-                            ind2 = list(frame_period.index)
-                            frame.loc[ind2, ind] = player_insert
+                            ind = lineups.find(sub_in, 10)
+                            lineups.patch(ind, player_insert)
                             home_players[ind - 10] = player_insert
                         home_sub_out.append(sub_out)
                         home_players[home_players.index(sub_out)] = sub_in
                         home_players_seen[home_players_seen.index(sub_out)] = sub_in
-                home_score, away_score = convert_text_to_scores(data[3].text)
+                home_score, away_score = convert_text_to_scores(node_text(data[3]))
             time_elapsed = period_length - time_remaining
             play_length = last_play - time_remaining
             if play_length > 0:
@@ -772,7 +1381,7 @@ def get_play_by_play(soup, starters, home_id, away_id):
                                                                                   possession, sub_in, sub_out, ft_num,
                                                                                   ft_total, draw_foul, foul, reason,
                                                                                   details]
-            frame = frame.append(pd.Series(frame_row), ignore_index=True)
+            frame.append(frame_row)
 
         ##############
         # reOrderedSet vars #
@@ -805,379 +1414,1756 @@ def get_play_by_play(soup, starters, home_id, away_id):
         ##################
         # End reOrderedSet vars #
         ##################
-    frame.columns = header
-    return frame
+    lineups.apply()
+    return frame.to_frame()
 
 
 # scrapes the refs for the game and returns a pandas dataframe
 # returns in the form of [game_id,refid, refid, refid]
 
 
-def get_refs(soup):
-    frame = pd.DataFrame()
-    html_table = soup.find_all('table', class_='margin_top small_text')[0]
-    row = html_table.find_all('tr')[0]
-    row_data = row.find_all('a')
+def get_refs(page):
+    frame = RowAccumulator(['game_id', 'Refid', 'Name'])
+    html_table = page['margin_top small_text'][0]
+    row = html_table.findall('.//tr')[0]
+    row_data = row.findall('.//a')
     for d in row_data:
-        frame = frame.append(pd.Series([None, url_to_id(d['href']), d.text]), ignore_index=True)
-    frame.columns = ['game_id', 'Refid', 'Name']
-    return frame
-
-
+        frame.append([None, url_to_id(d.get('href')), node_text(d)])
+    return frame.to_frame()
+
+
+# shot chart columns and the compact dtypes they are built with, shot_type and Result use the same values as the
+# play by play event_type / Result columns (2pt / 3pt, make / miss) so shots join straight onto their plays
+SHOT_COLUMNS = ['game_id', 'shot_id', 'team_id', 'player_id', 'Period', 'time_remaining', 'x', 'y', 'shot_type',
+                'Result', 'distance']
+SHOT_DTYPES = {'shot_id': 'int16', 'team_id': 'int8', 'player_id': 'category', 'Period': 'int8',
+               'time_remaining': 'float64', 'x': 'int16', 'y': 'int16', 'shot_type': 'category',
+               'Result': 'category', 'distance': 'Int8'}
+SHOT_POSITION = re.compile(r'top:\s*(-?\d+)px;\s*left:\s*(-?\d+)px')
+SHOT_CLOCK = re.compile(r'(\d+):(\d+(?:\.\d+)?) remaining')
+SHOT_PERIOD = re.compile(r'(\d)(?:st|nd|rd|th) q', re.IGNORECASE)
+SHOT_KIND = re.compile(r'([23])-p')
+SHOT_DISTANCE = re.compile(r'from (\d+) ft')
+
+
+# lxml parser target for the shot chart page, one <div class="shot-area" id="shots-LAL"> per team holding a
+# <div class="tooltip make p-1 pl-bryanko01" style="top:11px;left:15px;" tip="1st quarter, 11:07 remaining<br>..">
+# marker per shot. markers are read straight off their attributes as the page streams past, no tree is built
+# the period comes from the p-N class since overtime tips just say OT, the shooter from the pl- class
+class ShotCollector(object):
+    def __init__(self):
+        self.team = None
+        self.shots = RowAccumulator(SHOT_COLUMNS)
+
+    def start(self, tag, attrib):
+        if tag != 'div':
+            return
+        div_id = attrib.get('id') or ''
+        if div_id.startswith('shots-'):
+            self.team = convert_name_to_team_id(div_id[len('shots-'):])
+            return
+        classes = (attrib.get('class') or '').split()
+        if 'tooltip' not in classes or not ('make' in classes or 'miss' in classes):
+            return
+        tip = attrib.get('tip') or ''
+        period = None
+        player = None
+        for c in classes:
+            if c.startswith('p-') and c[2:].isdigit():
+                period = int(c[2:])
+            elif c.startswith('pl-'):
+                player = c[3:]
+        if period is None:
+            period = int(SHOT_PERIOD.search(tip).group(1))
+        position = SHOT_POSITION.search(attrib.get('style') or '')
+        clock = SHOT_CLOCK.search(tip)
+        kind = SHOT_KIND.search(tip)
+        distance = SHOT_DISTANCE.search(tip)
+        self.shots.append([None, len(self.shots), self.team, player, period,
+                           int(clock.group(1)) * 60 + float(clock.group(2)),
+                           int(position.group(2)), int(position.group(1)), kind.group(1) + 'pt',
+                           'make' if 'make' in classes else 'miss', int(distance.group(1)) if distance else None])
+
+    def end(self, tag):
+        pass
+
+    def data(self, data):
+        pass
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        return self.shots.to_frame(SHOT_DTYPES)
+
+
+# scrapes every shot of the shot chart page into a frame of SHOT_COLUMNS
+# x / y are the marker's pixel offsets on the court image, time_remaining the seconds left in the period
+def get_shot_chart(html):
+    parser = etree.HTMLParser(target=ShotCollector())
+    parser.feed(html)
+    return parser.close()
+
+
+# adds the play_id of each shot's make / miss row in the play by play (missing when no row matches)
+# shot chart clocks are cut to the second, so shots and plays are matched on game, period, shooter, result, shot
+# type and the whole second remaining, and the n-th shot of such a key goes to the n-th play of the same key
+def join_shots_to_play_by_play(shots, pbp):
+    keys = ['game_id', 'Period', 'player_id', 'Result', 'shot_type', 'second', 'nth']
+    plays = pbp.loc[pbp['event_type'].isin(['2pt', '3pt']),
+                    ['game_id', 'Period', 'player_id', 'Result', 'event_type', 'time_remaining', 'play_id']]
+    plays = plays.rename(columns={'event_type': 'shot_type'})
+    left = shots[keys[:-2]].astype(str)
+    right = plays[keys[:-2]].astype(str)
+    for frame, clock in ((left, shots['time_remaining']), (right, plays['time_remaining'])):
+        frame['second'] = ((clock * 10).round() // 10).values
+        frame['nth'] = frame.groupby(keys[:-1]).cumcount()
+    right['play_id'] = plays['play_id'].values
+    shots = shots.copy()
+    shots['play_id'] = left.merge(right, how='left', on=keys)['play_id'].astype('Int32').values
+    return shots
+
+
+HOME_SLOTS = ['H1', 'H2', 'H3', 'H4', 'H5']
+AWAY_SLOTS = ['A1', 'A2', 'A3', 'A4', 'A5']
+
+
+# rebuilds the basic box score from the play by play
+# the H1-H5 / A1-A5 lineup columns are melted into one (event, player on court) row each, so every stat is a column
+# of flags over those rows and the whole box score is a single groupby
+# pbp can hold many games, when it has game_id values the result has a game_id column and one row per game and player
+# players are listed home team first, in the order they show up in H1, H2, .. then A1, A2, ..
 def generate_bs_from_pbp(pbp):
     header = ['player_id', 'MP', 'FG', 'FGA', '3P', '3PA', 'FT', 'FTA', 'ORB', 'DRB', 'TRB', 'AST', 'STL', 'BLK', 'TOV',
               'PF', 'PTS']
-    frame = pd.DataFrame()
-    h1 = list(pbp['H1'])
-    h2 = list(pbp['H2'])
-    h3 = list(pbp['H3'])
-    h4 = list(pbp['H4'])
-    h5 = list(pbp['H5'])
-    home_players = OrderedSet(h1 + h2 + h3 + h4 + h5)
+    by_game = 'game_id' in pbp.columns and pbp['game_id'].notnull().any()
+    events = pbp.reset_index(drop=True)
+
+    on_court = []
+    for side, slots in ((0, HOME_SLOTS), (1, AWAY_SLOTS)):
+        side_players = events[slots].melt(value_vars=slots, value_name='on_court', ignore_index=False)
+        side_players['side'] = side
+        on_court.append(side_players[['on_court', 'side']])
+    on_court = pd.concat(on_court)
+    on_court = on_court[on_court['on_court'].notnull()]
+    on_court['event'] = on_court.index
+    # a player listed twice for the same event only counts once
+    on_court = on_court.drop_duplicates(['event', 'side', 'on_court'])
+
+    event_cols = ['play_length', 'player_id', 'event_type', 'Result', 'PTS', 'Assist', 'Block', 'Steal', 'foul',
+                  'draw foul', 'reason']
+    if by_game:
+        event_cols = ['game_id'] + event_cols
+    long = on_court.join(events[event_cols], on='event').reset_index(drop=True)
+    # player_id mixes player ids with team ids (team rebounds), compare everything as plain python objects
+    id_cols = ['on_court', 'player_id', 'Assist', 'Block', 'Steal', 'foul', 'draw foul']
+    long[id_cols] = long[id_cols].astype(object)
+    if by_game:
+        # keep games together in the order they first appear
+        game_order = pd.Series(range(len(events)), index=events.index).groupby(events['game_id'], sort=False).min()
+        long['game_order'] = long['game_id'].map(game_order)
+        long = long.sort_values(['game_order', 'side'], kind='stable').reset_index(drop=True)
+
+    p = long['on_court']
+    own_event = long['player_id'] == p
+    shot = own_event & long['Result'].isin(['make', 'miss'])
+    make = long['Result'] == 'make'
+    ft = long['event_type'] == 'ft'
+    three = long['event_type'] == '3pt'
+    flags = pd.DataFrame({'MP': long['play_length'],
+                          'FG': shot & make & ~ft,
+                          'FGA': shot & ~ft,
+                          '3P': shot & three & make,
+                          '3PA': shot & three,
+                          'FT': shot & ft & make,
+                          'FTA': shot & ft,
+                          'ORB': own_event & (long['event_type'] == 'Offensive rebound'),
+                          'DRB': own_event & (long['event_type'] == 'Defensive rebound'),
+                          'AST': long['Assist'] == p,
+                          'STL': long['Steal'] == p,
+                          'BLK': long['Block'] == p,
+                          'TOV': own_event & (long['event_type'] == 'turnover'),
+                          'PF': ((long['foul'] == p) & (long['reason'] != 'Technical')) |
+                                ((long['draw foul'] == p) & (long['reason'] == 'Double foul')),
+                          'PTS': long['PTS'].where(shot, 0)})
+    keys = ['side', 'on_court']
+    if by_game:
+        keys = ['game_id'] + keys
+    for k in keys:
+        flags[k] = long[k]
+    frame = flags.groupby(keys, sort=False, dropna=False).sum().reset_index()
+
+    # rounded so float noise in the summed play lengths can't drop a second
+    mp = frame['MP'].round(6)
+    m, sec = mp // 60, mp % 60
+    frame['MP'] = m.astype(int).astype(str) + ':' + sec.astype(int).astype(str).str.zfill(2)
+    frame['TRB'] = frame['ORB'] + frame['DRB']
+    frame = frame.rename(columns={'on_court': 'player_id'})
+    if by_game:
+        header = ['game_id'] + header
+    return frame[header]
+
+
+# largest difference allowed between the scraped box score and the one rebuilt from the play by play, per column
+# MP is compared in seconds, columns not listed have to match exactly
+COMPARE_TOLERANCES = {'MP': 60}
+
+
+# converts a column of 'MM:SS' minutes played into seconds, anything else (Did Not Play, missing) becomes NaN
+def minutes_to_seconds(mp):
+    parts = mp.astype(object).astype(str).str.extract(r'^\s*(\d+):(\d+)\s*$')
+    return parts[0].astype(float) * 60 + parts[1].astype(float)
+
+
+# compares the scraped player box score against generate_bs_from_pbp's, for one game or many
+# the frames are aligned on player_id (and game_id when both have one) with a single merge and every column is
+# checked in bulk against COMPARE_TOLERANCES (overridden by tolerances)
+# returns one row per mismatch: [game_id,] player_id, Category, BS, PBP, empty when everything matches
+# a player found in only one of the frames is reported with Category 'player' and None on the side missing him,
+# players that did not play and are absent from the play by play are skipped
+def compare_boxscores(bs, pbpbs, tolerances=None):
+    tol = dict(COMPARE_TOLERANCES)
+    tol.update(tolerances or {})
+    keys = ['player_id']
+    if 'game_id' in bs.columns and 'game_id' in pbpbs.columns:
+        keys = ['game_id', 'player_id']
+    cols = [c for c in pbpbs.columns if c not in keys]
+    header = keys + ['Category', 'BS', 'PBP']
+
+    left = bs[keys + cols].copy()
+    right = pbpbs[keys + cols].copy()
+    for frame in (left, right):
+        frame[keys] = frame[keys].astype(object)
+    left['_row'] = range(len(left))
+    merged = left.merge(right, on=keys, how='outer', suffixes=('_bs', '_pbp'), indicator=True, sort=False)
+    played = ~minutes_to_seconds(merged['MP_bs']).isnull() if 'MP' in cols else True
+    merged = merged[(merged['_merge'] != 'left_only') | played]
+    # players only in the pbp box score go after the rest
+    merged['_row'] = merged['_row'].fillna(len(left))
+
+    diffs = []
+    unmatched = merged[merged['_merge'] != 'both']
+    if len(unmatched):
+        frame = unmatched[keys + ['_row']].copy()
+        frame['Category'] = 'player'
+        frame['BS'] = unmatched['player_id'].where(unmatched['_merge'] == 'left_only', None)
+        frame['PBP'] = unmatched['player_id'].where(unmatched['_merge'] == 'right_only', None)
+        frame['_col'] = -1
+        diffs.append(frame)
+
+    both = merged[merged['_merge'] == 'both']
+    for i, c in enumerate(cols):
+        val1 = both[c + '_bs']
+        val2 = both[c + '_pbp']
+        if c == 'MP':
+            num1, num2 = minutes_to_seconds(val1), minutes_to_seconds(val2)
+        else:
+            num1, num2 = pd.to_numeric(val1, errors='coerce'), pd.to_numeric(val2, errors='coerce')
+        ok = (num1 - num2).abs() <= tol.get(c, 0)
+        # non numeric cells have to be equal
+        ok = ok | (num1.isnull() & num2.isnull() & (val1.astype(object) == val2.astype(object)))
+        bad = both[~ok]
+        if len(bad):
+            frame = bad[keys + ['_row']].copy()
+            frame['Category'] = c
+            frame['BS'] = bad[c + '_bs'].astype(object)
+            frame['PBP'] = bad[c + '_pbp'].astype(object)
+            frame['_col'] = i
+            diffs.append(frame)
+
+    if not diffs:
+        return pd.DataFrame(columns=header)
+    failures = pd.concat(diffs, ignore_index=True)
+    failures = failures.sort_values(['_row', '_col'], kind='stable')
+    return failures[header].reset_index(drop=True)
+
+
+# tables a game can be scraped into, named like the sink tables. the box score ones are what scrape_boxscore returns
+BOXSCORE_TABLE_NAMES = ('refs', 'playerStats', 'teamStats', 'fourFactors', 'finalScores', 'gameLengths')
+SCRAPE_TABLE_NAMES = BOXSCORE_TABLE_NAMES + ('pbp', 'shots', 'stints', 'possessions')
+# page each table is read from and the page tables parse_page has to collect for it (None: the raw html)
+TABLE_SOURCES = {'refs': ('boxscore', ('margin_top small_text',)),
+                 'playerStats': ('boxscore', ('sortable stats_table',)),
+                 'teamStats': ('boxscore', ('sortable stats_table',)),
+                 'fourFactors': ('boxscore', ('four_factors',)),
+                 'finalScores': ('boxscore', ('nav_table stats_table',)),
+                 'gameLengths': ('boxscore', ('margin_top small_text',)),
+                 'pbp': ('pbp', PBP_TABLES),
+                 'shots': ('shotchart', None)}
+# other tables each table is built from
+TABLE_INPUTS = {'pbp': ('playerStats', 'finalScores'), 'shots': ('pbp',), 'stints': ('pbp',), 'possessions': ('pbp',)}
+TABLE_STAGES = {'refs': 'refs', 'playerStats': 'boxscore', 'teamStats': 'boxscore', 'fourFactors': 'four_factors',
+                'finalScores': 'final_scores', 'gameLengths': 'game_length', 'pbp': 'pbp', 'shots': 'shots',
+                'stints': 'stints', 'possessions': 'possessions'}
+
+
+# whether names, the tables a game has written, hold every default box score table. only those games count as
+# stored (sink.games()), so games that only went through a --tables backfill are still scraped in full later
+def full_game(names):
+    return set(BOXSCORE_TABLE_NAMES).issubset(names)
+
+
+# names plus every table they are built from
+def table_closure(names):
+    needed = set()
+    todo = list(names)
+    while todo:
+        name = todo.pop()
+        if name not in SCRAPE_TABLE_NAMES:
+            raise ValueError('unknown table {0}'.format(name))
+        if name not in needed:
+            needed.add(name)
+            todo.extend(TABLE_INPUTS.get(name, ()))
+    return needed
+
+
+# pages that have to be downloaded to scrape the tables in names, in boxscore, pbp, shotchart order
+def table_pages(names):
+    pages = set(TABLE_SOURCES[name][0] for name in table_closure(names) if name in TABLE_SOURCES)
+    return tuple(p for p in ('boxscore', 'pbp', 'shotchart') if p in pages)
+
+
+# lazy scrape of one game: a table is only built when it is asked for, together with the tables it is built from,
+# and a page is only downloaded and parsed when one of those tables reads it. parse_page only collects the page
+# tables the planned tables read, so a final scores job never builds the box score tables or merges the advanced
+# stats. plan(names) starts all the downloads names need at once, get(name) builds (and keeps) one table
+# pages is an optional dict of already downloaded html keyed by page name, the rest come from fetcher (default the
+# shared one). building possessions adds possession_id / offense_team_id to the kept pbp
+class GameTables(object):
+    def __init__(self, link, pages=None, fetcher=None, timings=None):
+        self.link = link
+        self.game_id = url_to_id(link)
+        self.pages = dict(pages or {})
+        self.fetcher = fetcher
+        self.timings = timings
+        self.futures = {}
+        self.wanted = {}
+        self.parsed = {}
+        self.tables = {}
+
+    def plan(self, names):
+        for name in table_closure(names):
+            if name in TABLE_SOURCES:
+                page, wanted = TABLE_SOURCES[name]
+                self.wanted.setdefault(page, set()).update(wanted or ())
+        for page in self.wanted:
+            self.submit(page)
+
+    # starts downloading a page unless it was given or is already on its way
+    def submit(self, page):
+        if page not in self.pages and page not in self.futures:
+            fetcher = self.fetcher if self.fetcher is not None else get_default_fetcher()
+            self.futures[page] = fetcher.submit(page_url(self.link, page))
+
+    def html(self, page):
+        if page not in self.pages:
+            self.submit(page)
+            with timed(self.timings, 'fetch'):
+                self.pages[page] = self.futures.pop(page).result()
+        return self.pages[page]
+
+    # page index of a page holding at least the page tables planned so far, reparsed if more were planned since
+    def page(self, page):
+        wanted = self.wanted[page]
+        parsed = self.parsed.get(page)
+        if parsed is None or not wanted <= parsed[0]:
+            html = self.html(page)
+            with timed(self.timings, 'parse'):
+                parsed = (set(wanted), parse_page(html, tuple(wanted)))
+            self.parsed[page] = parsed
+        return parsed[1]
+
+    def get(self, name):
+        if name not in self.tables:
+            self.plan([name])
+            for dependency in TABLE_INPUTS.get(name, ()):
+                self.get(dependency)
+            source = None
+            if name in TABLE_SOURCES:
+                page, wanted = TABLE_SOURCES[name]
+                source = self.html(page) if wanted is None else self.page(page)
+            with timed(self.timings, TABLE_STAGES[name]):
+                built = self.build(name, source)
+            for frame in built.values():
+                frame['game_id'] = self.game_id
+            self.tables.update(built)
+        return self.tables[name]
+
+    # runs the extractor for name over its page (source) and the tables it is built from
+    # returns a dict of table name -> frame, get_boxscore_stats gives both player and team stats in one go
+    def build(self, name, source):
+        if name == 'refs':
+            return {'refs': get_refs(source)}
+        if name in ('playerStats', 'teamStats'):
+            players, teams = get_boxscore_stats(source)
+            return {'playerStats': players, 'teamStats': teams}
+        if name == 'fourFactors':
+            return {'fourFactors': get_four_factors(source)}
+        if name == 'finalScores':
+            return {'finalScores': get_final_scores(source)}
+        if name == 'gameLengths':
+            return {'gameLengths': get_game_length(source)}
+        if name == 'pbp':
+            home, away = get_team_id(self.tables['finalScores'])
+            starters = get_starters(self.tables['playerStats'], home, away)
+            return {'pbp': get_play_by_play(source, starters, home, away)}
+        if name == 'shots':
+            shots = get_shot_chart(source)
+            shots['game_id'] = self.game_id
+            return {'shots': join_shots_to_play_by_play(shots, self.tables['pbp'])}
+        if name == 'stints':
+            return {'stints': get_stints(self.tables['pbp'])}
+        pbp, possessions = get_possessions(self.tables['pbp'])
+        return {'pbp': pbp, 'possessions': possessions}
+
+
+# scrapes only the tables in names (see SCRAPE_TABLE_NAMES) for the game at link, e.g.
+# scrape_tables(link, ['finalScores']) downloads just the box score page and reads just the line score table
+# returns a dict of table name -> frame, pages / fetcher / timings as for GameTables
+def scrape_tables(link, names, pages=None, fetcher=None, timings=None):
+    game = GameTables(link, pages, fetcher, timings)
+    game.plan(names)
+    for name in names:
+        game.get(name)
+    return dict((name, game.tables[name]) for name in names)
+
+
+# takes in a link for the box score and returns refs, players, teams, four factors, scores and game length
+# pages is an optional dict of already downloaded html ('boxscore', 'pbp'), otherwise the pages needed are fetched
+# together. with play_by_play the play by play frame is scraped too and returned as a 7th value
+# timings is an optional dict that gets the wall time of every stage (see STAGES) added to it
+def scrape_boxscore(link, pages=None, play_by_play=False, timings=None):
+    print('start scraping')
+    names = BOXSCORE_TABLE_NAMES + (('pbp',) if play_by_play else ())
+    tables = scrape_tables(link, names, pages, timings=timings)
+    return tuple(tables[name] for name in names)
 
-    a1 = list(pbp['A1'])
-    a2 = list(pbp['A2'])
-    a3 = list(pbp['A3'])
-    a4 = list(pbp['A4'])
-    a5 = list(pbp['A5'])
-    away_players = OrderedSet(a1 + a2 + a3 + a4 + a5)
 
-    for h in home_players:
-        player_pbp = pbp[(pbp['H1'] == h) | (pbp['H2'] == h) | (pbp['H3'] == h) | (pbp['H4'] == h) | (pbp['H5'] == h)]
-        mp = sum(player_pbp['play_length'])
-        m, s = divmod(mp, 60)
-        mp = str(int(m)) + ':' + str(int(s)).zfill(2)
 
-        player_assists = player_pbp[(player_pbp['Assist'] == h)]
-        assist = len(player_assists.index)
+#################################################################################################################
+#                                                                                                               #
+#                                           Lineups                                                             #
+#                                                                                                               #
+#################################################################################################################
 
-        blk = len(player_pbp[(player_pbp['Block'] == h)].index)
 
-        stl = len(player_pbp[(player_pbp['Steal'] == h)].index)
+STINT_COLUMNS = ['game_id', 'stint_id', 'Period', 'time_remaining', 'home_team_id', 'away_team_id'] + HOME_SLOTS + \
+                AWAY_SLOTS + ['seconds', 'home_pts', 'away_pts', 'home_poss', 'away_poss']
+# totals kept for every lineup, for the team whose lineup it is (for) and its opponent (against)
+LINEUP_TOTALS = ['seconds', 'pts_for', 'pts_against', 'poss_for', 'poss_against']
+
+
+# splits a game's play by play into stints, one row per stretch of a period the same ten players were on the floor
+# the players of each side are sorted so the same five always give the same H1-H5 / A1-A5. a row's play_length is
+# the time since the row before it, so it counts for the stint of the row before it (the lineup that was on the
+# floor while it ran, subs show the new lineup on their own row), points and possessions count for the stint of the
+# row they happen on
+# possessions are estimated per team as FGA + 0.44 * FTA - ORB + TOV
+def get_stints(pbp):
+    pbp = pbp.reset_index(drop=True)
+    home = pd.DataFrame(np.sort(pbp[HOME_SLOTS].values.astype(str), axis=1), columns=HOME_SLOTS)
+    away = pd.DataFrame(np.sort(pbp[AWAY_SLOTS].values.astype(str), axis=1), columns=AWAY_SLOTS)
+    lineups = pd.concat([home, away], axis=1)
+    changed = (lineups != lineups.shift()).any(axis=1) | (pbp['Period'] != pbp['Period'].shift())
+    stint = changed.cumsum() - 1
+    clock_stint = stint.shift(1).fillna(0).astype(int)
+
+    event = pbp['event_type']
+    possession = (event.isin(['2pt', '3pt']).astype(float) + 0.44 * (event == 'ft') -
+                  (event == 'Offensive rebound') + (event == 'turnover'))
+    home_event = pbp['player_team_id'] == pbp['home_team_id']
+    away_event = pbp['player_team_id'] == pbp['away_team_id']
+    totals = pd.DataFrame({'home_pts': pbp['PTS'].where(home_event, 0), 'away_pts': pbp['PTS'].where(away_event, 0),
+                           'home_poss': possession.where(home_event, 0.0),
+                           'away_poss': possession.where(away_event, 0.0)}).groupby(stint).sum()
+
+    first = pbp.loc[changed, ['game_id', 'Period', 'time_remaining', 'home_team_id', 'away_team_id']]
+    stints = pd.concat([first.reset_index(drop=True), lineups.loc[changed].reset_index(drop=True)], axis=1)
+    stints['stint_id'] = range(len(stints))
+    seconds = pbp['play_length'].groupby(clock_stint).sum().round(1)
+    stints['seconds'] = seconds.reindex(range(len(stints)), fill_value=0.0).values
+    for c in totals.columns:
+        stints[c] = totals[c].values
+    return stints[STINT_COLUMNS]
+
+
+# one row per team per stint: the team, its five players as P1-P5 and the LINEUP_TOTALS while they were on
+def stint_units(stints):
+    sides = []
+    for team, opponent, slots, side, other in (('home_team_id', 'away_team_id', HOME_SLOTS, 'home', 'away'),
+                                               ('away_team_id', 'home_team_id', AWAY_SLOTS, 'away', 'home')):
+        unit = pd.DataFrame({'game_id': stints['game_id'].values, 'stint_id': stints['stint_id'].values,
+                             'team_id': stints[team].values, 'opponent_id': stints[opponent].values})
+        for i, slot in enumerate(slots):
+            unit['P{0}'.format(i + 1)] = stints[slot].values
+        unit['seconds'] = stints['seconds'].values
+        unit['pts_for'] = stints[side + '_pts'].values
+        unit['pts_against'] = stints[other + '_pts'].values
+        unit['poss_for'] = stints[side + '_poss'].values
+        unit['poss_against'] = stints[other + '_poss'].values
+        sides.append(unit)
+    return pd.concat(sides, ignore_index=True)
+
+
+# adds plus minus and per 100 possession ratings to a frame of LINEUP_TOTALS
+def lineup_ratings(frame):
+    frame['plus_minus'] = frame['pts_for'] - frame['pts_against']
+    frame['off_rtg'] = 100 * frame['pts_for'] / frame['poss_for'].where(frame['poss_for'] > 0)
+    frame['def_rtg'] = 100 * frame['pts_against'] / frame['poss_against'].where(frame['poss_against'] > 0)
+    frame['net_rtg'] = frame['off_rtg'] - frame['def_rtg']
+    return frame
 
-        player_shots = player_pbp[
-            (player_pbp['player_id'] == h) & ((player_pbp['Result'] == 'make') | (player_pbp['Result'] == 'miss'))]
-        fga = len(player_shots[(player_shots['event_type'] != 'ft')])
-        fg = len(player_shots[(player_shots['Result'] == 'make') & (player_shots['event_type'] != 'ft')])
-        threes_attempted = len(player_shots[player_shots['event_type'] == '3pt'])
-        threes_made = len(player_shots[(player_shots['event_type'] == '3pt') & (player_shots['Result'] == 'make')])
-        fta = len(player_shots[(player_shots['event_type'] == 'ft')])
-        ft = len(player_shots[(player_shots['event_type'] == 'ft') & (player_shots['Result'] == 'make')])
-        pts = sum(player_shots['PTS'])
 
-        pf = len(player_pbp[(((player_pbp['foul'] == h) & (player_pbp['reason'] != 'Technical')) |
-                             ((player_pbp['draw foul'] == h) & (player_pbp['reason'] == 'Double foul')))])
+# lineup aggregation over stint tables, built up as games come in with add(stints) (one game or a whole part file)
+# the stints are kept as team units (stint_units) plus a posting list of unit rows per player, so totals for any
+# group of players on one team only touch the units all of them were on instead of rescanning the play by play
+#   index.query(['jamesle01', 'wadedw01']) -> totals for the two of them on the floor together
+#   index.combinations(3, min_seconds=600) -> every three man group with at least ten minutes together
+class LineupIndex(object):
+    def __init__(self, stints=None):
+        self.parts = []
+        self.postings = {}
+        self.size = 0
+        self.cache = None
+        if stints is not None:
+            self.add(stints)
+
+    def add(self, stints):
+        if stints is None or not len(stints):
+            return
+        units = stint_units(stints)
+        rows = np.arange(self.size, self.size + len(units))
+        for slot in ('P1', 'P2', 'P3', 'P4', 'P5'):
+            for player, ind in units.groupby(slot).indices.items():
+                self.postings.setdefault(player, []).append(rows[ind])
+        self.size += len(units)
+        self.parts.append(units)
+        self.cache = None
+
+    def units(self):
+        if self.cache is None:
+            self.cache = pd.concat(self.parts, ignore_index=True) if self.parts else stint_units(
+                pd.DataFrame(columns=STINT_COLUMNS))
+        return self.cache
+
+    # unit rows that had every one of players on the floor
+    def rows(self, players):
+        found = None
+        for player in players:
+            rows = set(np.concatenate(self.postings[player])) if player in self.postings else set()
+            found = rows if found is None else found & rows
+        return sorted(found or [])
+
+    # LINEUP_TOTALS and ratings for players on the floor together, units is the number of stints that adds up
+    def query(self, players):
+        units = self.units().iloc[self.rows(players)]
+        totals = units[LINEUP_TOTALS].sum()
+        totals['units'] = len(units)
+        return lineup_ratings(totals.to_frame().T).iloc[0]
+
+    # totals for every size-man group of players that shared the floor, one row per team_id, P1..Psize
+    # (sorted player ids) with at least min_seconds together, longest first
+    def combinations(self, size, min_seconds=0):
+        units = self.units()
+        if size < 1 or size > 5:
+            raise ValueError('lineups have 1 to 5 players, not {0}'.format(size))
+        names = ['P{0}'.format(i + 1) for i in range(size)]
+        groups = []
+        for slots in itertools.combinations(['P1', 'P2', 'P3', 'P4', 'P5'], size):
+            group = units[['team_id'] + list(slots) + LINEUP_TOTALS]
+            group.columns = ['team_id'] + names + LINEUP_TOTALS
+            groups.append(group)
+        frame = pd.concat(groups, ignore_index=True).groupby(['team_id'] + names, as_index=False)[LINEUP_TOTALS].sum()
+        frame = frame[frame['seconds'] >= min_seconds]
+        return lineup_ratings(frame.sort_values('seconds', ascending=False).reset_index(drop=True))
 
-        tov = len(player_pbp[(player_pbp['event_type'] == 'turnover') & (player_pbp['player_id'] == h)])
 
-        orb = len(player_pbp[(player_pbp['event_type'] == 'Offensive rebound') & (player_pbp['player_id'] == h)])
+#################################################################################################################
+#                                                                                                               #
+#                                           Possessions                                                         #
+#                                                                                                               #
+#################################################################################################################
 
-        drb = len(player_pbp[(player_pbp['event_type'] == 'Defensive rebound') & (player_pbp['player_id'] == h)])
 
-        trb = orb + drb
+# events that show which team has the ball: the shooter's / turnover's / rebounder's team (the defensive rebounder's
+# team has the ball from that row on). technical free throws don't, they are shot by either team mid possession
+POSSESSION_EVENTS = ('2pt', '3pt', 'ft', 'turnover', 'Offensive rebound', 'Defensive rebound')
+POSSESSION_COLUMNS = ['game_id', 'possession_id', 'Period', 'time_remaining', 'offense_team_id', 'defense_team_id',
+                      'seconds', 'points', 'defense_points', 'FGA', 'FTA', 'ORB', 'TOV']
+
+
+# splits a game's play by play into possessions in one pass over its events
+# a new possession starts with every period and whenever an event shows the other team has the ball, rows that show
+# neither (fouls, timeouts, subs, ..) stay in the possession they happen in and the ones opening a period go to its
+# first possession. returns the play by play with possession_id and offense_team_id added and one summary row per
+# possession: its clock time (the play_length of its rows, except that the time up to a defensive rebound still
+# belongs to the possession of the missed shot), the offense's points, FGA, FTA, ORB and TOV and any points the
+# defense scored in it (technical free throws)
+def get_possessions(pbp):
+    pbp = pbp.reset_index(drop=True)
+    event = pbp['event_type']
+    ball = event.isin(POSSESSION_EVENTS) & ~((event == 'ft') & pbp['details'].str.contains('technical', na=False))
+    # a jump ball goes to the side of the player who gained it, jumps that don't name one leave it undecided
+    home_gains = pbp[HOME_SLOTS].eq(pbp['Possession'], axis=0).any(axis=1)
+    away_gains = pbp[AWAY_SLOTS].eq(pbp['Possession'], axis=0).any(axis=1)
+    jump_team = pbp['home_team_id'].where(home_gains, pbp['away_team_id'].where(away_gains))
+    teams = pbp['player_team_id'].where(ball, jump_team.where((event == 'Jump') & pbp['Possession'].notna()))
+
+    possession_ids = []
+    offense = []
+    possession = -1
+    current = None
+    period = None
+    for row_period, team in zip(pbp['Period'], teams):
+        if row_period != period:
+            period = row_period
+            possession += 1
+            current = None
+            offense.append(None)
+        if team == team and team != current:
+            if current is not None:
+                possession += 1
+                offense.append(None)
+            current = team
+            offense[possession] = team
+        possession_ids.append(possession)
+
+    pbp['possession_id'] = possession_ids
+    pbp['offense_team_id'] = pbp['possession_id'].map(dict(enumerate(offense))).astype(float)
+    on_offense = pbp['player_team_id'] == pbp['offense_team_id']
+    on_defense = pbp['player_team_id'].notna() & ~on_offense
+    rebound_start = (event == 'Defensive rebound') & (pbp['possession_id'] != pbp['possession_id'].shift())
+    clock_possession = pbp['possession_id'] - rebound_start.astype(int)
+    counts = pd.DataFrame({'points': pbp['PTS'].where(on_offense, 0), 'defense_points': pbp['PTS'].where(on_defense, 0),
+                           'FGA': on_offense & event.isin(['2pt', '3pt']), 'FTA': on_offense & (event == 'ft'),
+                           'ORB': on_offense & (event == 'Offensive rebound'),
+                           'TOV': on_offense & (event == 'turnover')}).groupby(pbp['possession_id']).sum()
+
+    first = ~pbp['possession_id'].duplicated()
+    possessions = pbp.loc[first, ['game_id', 'possession_id', 'Period', 'time_remaining', 'offense_team_id']]
+    possessions = possessions.reset_index(drop=True)
+    home = possessions['offense_team_id'] == pbp['home_team_id'].iloc[0]
+    possessions['defense_team_id'] = pbp['away_team_id'].iloc[0]
+    possessions['defense_team_id'] = possessions['defense_team_id'].where(home, pbp['home_team_id'].iloc[0])
+    possessions['defense_team_id'] = possessions['defense_team_id'].where(possessions['offense_team_id'].notna())
+    seconds = pbp['play_length'].groupby(clock_possession).sum().round(1)
+    possessions['seconds'] = seconds.reindex(range(len(possessions)), fill_value=0.0).values
+    for c in counts.columns:
+        possessions[c] = counts[c].astype(int).values
+    return pbp, possessions[POSSESSION_COLUMNS]
+
+
+# pace (possessions per 48 minutes) and offensive / defensive rating (points per 100 possessions) per team from
+# possession summaries of any number of games, grouped by the columns in by plus team_id. season can be used in by
+# without being a column of the summaries, e.g. possession_ratings(possessions, by=['season'])
+def possession_ratings(possessions, by=('game_id',)):
+    by = list(by)
+    possessions = possessions[possessions['offense_team_id'].notna()]
+    if 'season' in by and 'season' not in possessions.columns:
+        possessions = possessions.assign(season=possessions['game_id'].map(lambda g: game_partition(g)[0]))
+    sides = []
+    for team, prefix in (('offense_team_id', ''), ('defense_team_id', 'opp_')):
+        side = possessions.groupby(by + [team]).agg(poss=('possession_id', 'size'), pts=('points', 'sum'),
+                                                     extra=('defense_points', 'sum'), seconds=('seconds', 'sum'))
+        side.index = side.index.set_names(by + ['team_id'])
+        sides.append(side.add_prefix(prefix))
+    ratings = sides[0].join(sides[1], how='outer').fillna(0)
+    ratings['PTS'] = ratings['pts'] + ratings['opp_extra']
+    ratings['opp_PTS'] = ratings['opp_pts'] + ratings['extra']
+    ratings['Pace'] = 2880 * (ratings['poss'] + ratings['opp_poss']) / 2 / (ratings['seconds'] + ratings['opp_seconds'])
+    ratings['ORtg'] = 100 * ratings['PTS'] / ratings['poss']
+    ratings['DRtg'] = 100 * ratings['opp_PTS'] / ratings['opp_poss']
+    return ratings[['poss', 'opp_poss', 'PTS', 'opp_PTS', 'Pace', 'ORtg', 'DRtg']].reset_index()
 
-        frame = frame.append(
-            pd.Series([h, mp, fg, fga, threes_made, threes_attempted, ft, fta, orb, drb, trb, assist, stl, blk, tov, pf,
-                       pts]), ignore_index=True)
 
-    for a in away_players:
-        player_pbp = pbp[(pbp['A1'] == a) | (pbp['A2'] == a) | (pbp['A3'] == a) | (pbp['A4'] == a) | (pbp['A5'] == a)]
-        mp = sum(player_pbp['play_length'])
-        m, s = divmod(mp, 60)
-        mp = str(int(m)) + ':' + str(int(s)).zfill(2)
-        player_assists = player_pbp[(player_pbp['Assist'] == a)]
-        assist = len(player_assists.index)
+#################################################################################################################
+#                                                                                                               #
+#                                           Storage                                                             #
+#                                                                                                               #
+#################################################################################################################
 
-        block = len(player_pbp[(player_pbp['Block'] == a)].index)
 
-        steal = len(player_pbp[(player_pbp['Steal'] == a)].index)
+# object columns holding more than one python type (player_id mixes player and team ids) are written as strings
+# so arrow can store them
+def arrow_safe(frame):
+    frame = frame.copy()
+    for c in frame.columns:
+        if frame[c].dtype == object:
+            types = set(type(v) for v in frame[c] if not pd.isnull(v))
+            if len(types) > 1:
+                frame[c] = frame[c].map(lambda v: None if pd.isnull(v) else str(v))
+    return frame
 
-        player_shots = player_pbp[
-            (player_pbp['player_id'] == a) & ((player_pbp['Result'] == 'make') | (player_pbp['Result'] == 'miss'))]
-        fga = len(player_shots[(player_shots['event_type'] != 'ft')])
-        fg = len(player_shots[(player_shots['Result'] == 'make') & (player_shots['event_type'] != 'ft')])
-        threes_attempted = len(player_shots[player_shots['event_type'] == '3pt'])
-        threes_made = len(player_shots[(player_shots['event_type'] == '3pt') & (player_shots['Result'] == 'make')])
-        fta = len(player_shots[(player_shots['event_type'] == 'ft')])
-        ft = len(player_shots[(player_shots['event_type'] == 'ft') & (player_shots['Result'] == 'make')])
-        points = sum(player_shots['PTS'])
 
-        fouls = len(player_pbp[(((player_pbp['foul'] == a) & (player_pbp['reason'] != 'Technical')) |
-                                ((player_pbp['draw foul'] == a) & (player_pbp['reason'] == 'Double foul')))])
+# compact play by play encoding, see compact_play_by_play
+# id, event and text columns become categoricals (each distinct string is stored once plus small int codes),
+# counters and scores get fixed width ints and the clock columns are stored as int16 tenths of a second
+PBP_CATEGORY_COLUMNS = ('game_id', 'H1', 'H2', 'H3', 'H4', 'H5', 'A1', 'A2', 'A3', 'A4', 'A5', 'event_type',
+                        'player_id', 'Opponent_id', 'Assist', 'Block', 'Steal', 'Result', 'home_jump', 'away_jump',
+                        'Possession', 'sub_in', 'sub_out', 'ft_num', 'ft_total', 'draw foul', 'foul', 'reason',
+                        'details')
+PBP_INT_DTYPES = {'play_id': 'int32', 'Period': 'int8', 'home_team_id': 'int8', 'away_team_id': 'int8',
+                  'home_score': 'Int16', 'away_score': 'Int16', 'player_team_id': 'Int8', 'PTS': 'int8',
+                  'possession_id': 'int16', 'offense_team_id': 'Int8'}
+PBP_CLOCK_COLUMNS = ('time_remaining', 'time_elapsed', 'play_length')
+
+
+# takes a play by play frame in the get_play_by_play layout and returns the compact encoding
+# the original dtype of every column is kept in frame.attrs['pbp_dtypes'] so expand_play_by_play can restore it
+# a clock column is only stored in tenths when that is exact, otherwise it stays float64
+def compact_play_by_play(pbp):
+    columns = {}
+    dtypes = {}
+    for c in pbp.columns:
+        values = pbp[c]
+        dtypes[c] = str(values.dtype)
+        if c in PBP_CLOCK_COLUMNS:
+            tenths = (values * 10).round()
+            if values.notna().all() and tenths.abs().max() < 2 ** 15 and (tenths / 10 == values).all():
+                values = tenths.astype('int16')
+        elif c in PBP_INT_DTYPES:
+            values = values.astype(PBP_INT_DTYPES[c])
+        elif c in PBP_CATEGORY_COLUMNS:
+            values = values.astype('category')
+        columns[c] = values
+    frame = pd.DataFrame(columns)
+    frame.attrs['pbp_dtypes'] = dtypes
+    return frame
 
-        turnovers = len(player_pbp[(player_pbp['event_type'] == 'turnover') & (player_pbp['player_id'] == a)])
 
-        orb = len(player_pbp[(player_pbp['event_type'] == 'Offensive rebound') & (player_pbp['player_id'] == a)])
+# turns a compact_play_by_play frame back into the get_play_by_play layout and dtypes
+# dtypes defaults to the ones recorded by compact_play_by_play, missing values in object columns come back as None
+def expand_play_by_play(compact, dtypes=None):
+    if dtypes is None:
+        dtypes = compact.attrs['pbp_dtypes']
+    columns = {}
+    for c in compact.columns:
+        values = compact[c]
+        if c in PBP_CLOCK_COLUMNS and values.dtype == 'int16':
+            values = values / 10
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+            if dtypes[c] == 'object':
+                values = values.where(values.notna(), None)
+        if dtypes[c] != 'object':
+            values = values.astype(dtypes[c])
+        columns[c] = values
+    return pd.DataFrame(columns)
+
+
+# concatenates compact play by play frames (e.g. one per game into a season) without losing the categoricals,
+# pd.concat falls back to object columns when the category sets differ so they are unified first
+def concat_play_by_play(frames):
+    frames = [f.copy() for f in frames]
+    for c in frames[0].columns:
+        if isinstance(frames[0][c].dtype, pd.CategoricalDtype):
+            categories = list(dict.fromkeys(v for f in frames for v in f[c].cat.categories))
+            for f in frames:
+                f[c] = f[c].cat.set_categories(categories)
+    dtypes = {}
+    for f in frames:
+        for c, dtype in f.attrs['pbp_dtypes'].items():
+            dtypes[c] = dtype if dtypes.get(c, dtype) == dtype else 'object'
+    frame = pd.concat(frames, ignore_index=True)
+    frame.attrs['pbp_dtypes'] = dtypes
+    return frame
 
-        drb = len(player_pbp[(player_pbp['event_type'] == 'Defensive rebound') & (player_pbp['player_id'] == a)])
 
-        total_rebounds = orb + drb
+# append only writer for one output table
+# frames are buffered and written out on flush, csv rows are appended to the current part file until it holds
+# part_rows rows (or the columns change) and then a new part is started. parquet writes one part file per flush
+# the manifest keeps each csv part's size, rows appended after the last manifest write are cut off again on open
+class TableSink(object):
+    def __init__(self, directory, name, fmt='csv', part_rows=SINK_PART_ROWS, parts=None):
+        if fmt == 'parquet' and pa is None:
+            raise ImportError('pyarrow is needed to write parquet parts')
+        self.directory = os.path.join(directory, name)
+        self.name = name
+        self.fmt = fmt
+        self.part_rows = part_rows
+        self.parts = parts if parts is not None else []
+        self.buffer = []
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        for part in self.parts:
+            path = os.path.join(directory, part['file'])
+            if 'bytes' in part and os.path.exists(path) and os.path.getsize(path) > part['bytes']:
+                os.truncate(path, part['bytes'])
+
+    def append(self, frame):
+        if frame is not None and len(frame):
+            self.buffer.append(frame)
+
+    def new_part(self, columns):
+        part = {'file': os.path.join(self.name, 'part-{0:05d}.{1}'.format(len(self.parts), self.fmt)), 'rows': 0,
+                'columns': [str(c) for c in columns]}
+        self.parts.append(part)
+        return part
+
+    def flush(self):
+        if not self.buffer:
+            return
+        frame = pd.concat(self.buffer, ignore_index=True)
+        self.buffer = []
+        if self.fmt == 'parquet':
+            part = self.new_part(frame.columns)
+            pq.write_table(pa.Table.from_pandas(arrow_safe(frame), preserve_index=False),
+                           os.path.join(os.path.dirname(self.directory), part['file']))
+            part['rows'] = len(frame)
+            return
+        columns = [str(c) for c in frame.columns]
+        part = self.parts[-1] if self.parts else None
+        if part is None or part['rows'] >= self.part_rows or part['columns'] != columns:
+            part = self.new_part(columns)
+        path = os.path.join(os.path.dirname(self.directory), part['file'])
+        # a new part overwrites whatever a crashed run left under its name
+        frame.to_csv(path, mode='a' if part['rows'] else 'w', header=part['rows'] == 0, index=False)
+        part['rows'] += len(frame)
+        part['bytes'] = os.path.getsize(path)
+
+
+# streams every game's tables to disk as they are scraped instead of holding whole seasons in memory
+# each table gets its own directory of part files, manifest.json lists the parts, their row counts, the game ids
+# stored in full so far (see full_game) and which tables each game has written. the manifest is rewritten after
+# every flush, part rows written past it are dropped when the sink is opened again so a crash loses at most one
+# batch and never writes it twice. the parts are append only, so a table a game already wrote is not written again
+# when the game comes back (a retried or re-validated game only adds the tables it didn't have, like its pbp)
+class ResultSink(object):
+    def __init__(self, directory=RESULTS_DIR, fmt='csv', batch_games=SINK_BATCH_GAMES, part_rows=SINK_PART_ROWS,
+                 on_flush=None):
+        self.directory = directory
+        self.on_flush = on_flush
+        self.fmt = fmt
+        self.batch_games = batch_games
+        self.part_rows = part_rows
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self.manifest = {'format': fmt, 'tables': {}, 'games': [], 'written': {}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+            if self.manifest['format'] != fmt:
+                raise ValueError('{0} already holds {1} parts'.format(directory, self.manifest['format']))
+            self.manifest.setdefault('written', {})
+        elif not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.tables = {}
+        self.pending_games = []
+        self.pending_written = {}
+
+    def table(self, name):
+        sink = self.tables.get(name)
+        if sink is None:
+            parts = self.manifest['tables'].setdefault(name, [])
+            sink = TableSink(self.directory, name, self.fmt, self.part_rows, parts)
+            self.tables[name] = sink
+        return sink
+
+    # tables is a dict of table name -> DataFrame for one game, tables the game already wrote are skipped
+    def write_game(self, game_id, tables):
+        written = self.pending_written.setdefault(game_id, set())
+        done = written | set(self.manifest['written'].get(game_id, ()))
+        for name, frame in tables.items():
+            if name not in done:
+                self.table(name).append(frame)
+                written.add(name)
+        self.pending_games.append(game_id)
+        if len(self.pending_games) >= self.batch_games:
+            self.flush()
+
+    # on_flush is called with the game ids that just became durable
+    def flush(self):
+        for sink in self.tables.values():
+            sink.flush()
+        flushed = self.pending_games
+        known = set(self.manifest['games'])
+        for game_id, names in self.pending_written.items():
+            self.manifest['written'][game_id] = sorted(names.union(self.manifest['written'].get(game_id, ())))
+        self.manifest['games'].extend(g for g in dict.fromkeys(flushed)
+                                      if g not in known and full_game(self.manifest['written'].get(g, ())))
+        self.pending_games = []
+        self.pending_written = {}
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp, self.manifest_path)
+        if self.on_flush is not None and flushed:
+            self.on_flush(flushed)
+
+    def close(self):
+        self.flush()
+
+    # game ids already stored with every default table, from the manifest
+    def games(self):
+        written = self.manifest['written']
+        return set(self.manifest['games']) | set(g for g, names in self.pending_written.items()
+                                                 if full_game(names.union(written.get(g, ()))))
+
+    # yields (part file, frame) for every part file of a table
+    def read_parts(self, name):
+        for part in self.manifest['tables'].get(name, []):
+            path = os.path.join(self.directory, part['file'])
+            if self.fmt == 'parquet':
+                yield part['file'], pd.read_parquet(path)
+            else:
+                yield part['file'], pd.read_csv(path)
+
+    # reads a table back from its part files
+    def read(self, name):
+        frames = [frame for _, frame in self.read_parts(name)]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+
+# tables holding play by play, these get the compact encoding when written to parquet or the game store
+PBP_TABLE_NAMES = ('pbp', 'pbpToFix')
+
+# fixed width ints for the small id / flag columns of the exported tables, only used when a column has no gaps
+PARQUET_INT_DTYPES = {'team_id': 'int8', 'H/A': 'int8', 'OT': 'int8', '#OT': 'int8'}
+PARQUET_PARTITIONS = ['season', 'home_team']
+
+
+# season (the year it ends in, like the Season column of seasons_excel.csv) and home team of a game id
+def game_partition(game_id):
+    year, month = int(game_id[:4]), int(game_id[4:6])
+    return (year + 1 if month >= 8 else year), game_id[-3:]
+
+
+# types a scraped table for parquet and tags every row with its season and home_team partition
+# play by play gets the compact categorical encoding, which arrow stores as dictionary columns, and shots read back
+# from csv parts get their compact dtypes again
+def parquet_frame(name, frame):
+    frame = frame.copy()
+    for c, dtype in PARQUET_INT_DTYPES.items():
+        if c in frame.columns:
+            values = pd.to_numeric(frame[c], errors='coerce')
+            if values.notna().all() and (values % 1 == 0).all():
+                frame[c] = values.astype(dtype)
+    frame = arrow_safe(frame)
+    frame['game_id'] = frame['game_id'].astype(str)
+    if name in PBP_TABLE_NAMES:
+        frame = compact_play_by_play(frame)
+    elif name == 'shots':
+        frame = frame.astype(dict(SHOT_DTYPES, play_id='Int32'))
+    partitions = {game_id: game_partition(game_id) for game_id in frame['game_id'].unique()}
+    frame['season'] = frame['game_id'].map(lambda g: partitions[g][0]).astype('int16')
+    frame['home_team'] = frame['game_id'].map(lambda g: partitions[g][1]).astype(str)
+    return frame
 
-        frame = frame.append(
-            pd.Series(
-                [a, mp, fg, fga, threes_made, threes_attempted, ft, fta, orb, drb, total_rebounds, assist, steal, block,
-                 turnovers, fouls, points]),
-            ignore_index=True)
 
-    frame.columns = header
-    return frame
+# exports the tables of a ResultSink (csv or parquet parts) as parquet datasets laid out as
+# <directory>/<table>/season=2016/home_team=BOS/<part>-0.parquet so a season or a team can be read on its own, e.g.
+# pd.read_parquet(PARQUET_DIR + '/pbp', columns=['game_id', 'event_type'], filters=[('season', '=', 2016)])
+# every sink part is converted on its own and written under its own file name, so re-exporting replaces files
+def export_parquet(sink, directory=PARQUET_DIR, tables=None):
+    if pa is None:
+        raise ImportError('pyarrow is needed to export parquet')
+    if tables is None:
+        tables = sorted(sink.manifest['tables'])
+    for name in tables:
+        for part_file, frame in sink.read_parts(name):
+            if frame.empty:
+                continue
+            frame = parquet_frame(name, frame)
+            stem = os.path.splitext(os.path.basename(part_file))[0]
+            pq.write_to_dataset(pa.Table.from_pandas(frame, preserve_index=False), os.path.join(directory, name),
+                                partition_cols=PARQUET_PARTITIONS, basename_template=stem + '-{i}.parquet')
+
+
+# column names used in the sql tables for the scraped headers that aren't valid identifiers
+SQL_COLUMN_NAMES = {'3P': 'fg3', '3PA': 'fg3a', '3P%': 'fg3_pct', '3PAr': 'fg3a_rate', 'FTr': 'fta_rate',
+                    '+/-': 'plus_minus', 'FT/FGA': 'ft_per_fga', 'H/A': 'home', '#OT': 'num_ot', '1': 'q1', '2': 'q2',
+                    '3': 'q3', '4': 'q4', 'T': 'total', 'Refid': 'ref_id', 'GameLength': 'game_length',
+                    'Opponent_id': 'opponent_id', 'draw foul': 'draw_foul'}
+
+BOXSCORE_STATS = ['FG', 'FGA', 'FG%', '3P', '3PA', '3P%', 'FT', 'FTA', 'FT%', 'ORB', 'DRB', 'TRB', 'AST', 'STL', 'BLK',
+                  'TOV', 'PF', 'PTS', '+/-', 'TS%', 'eFG%', '3PAr', 'FTr', 'ORB%', 'DRB%', 'TRB%', 'AST%', 'STL%',
+                  'BLK%', 'TOV%', 'USG%', 'ORtg', 'DRtg']
+PBP_STRING_COLUMNS = ['H1', 'H2', 'H3', 'H4', 'H5', 'A1', 'A2', 'A3', 'A4', 'A5', 'event_type', 'player_id',
+                      'Opponent_id', 'Assist', 'Block', 'Steal', 'Result', 'home_jump', 'away_jump', 'Possession',
+                      'sub_in', 'sub_out', 'ft_num', 'ft_total', 'draw foul', 'foul', 'reason', 'details']
+
+
+def sql_name(column):
+    if column in SQL_COLUMN_NAMES:
+        return SQL_COLUMN_NAMES[column]
+    return column.lower().replace('%', '_pct').replace(' ', '_').replace('/', '_')
+
+
+# builds the normalised schema: games, teams, players and referees plus one table per scraped frame, each keyed
+# and indexed on game_id / player_id / team_id
+def build_sql_schema(metadata):
+    def stats(names):
+        return [Column(sql_name(c), Float) for c in names]
+
+    tables = {}
+    tables['teams'] = Table('teams', metadata, Column('team_id', Integer, primary_key=True),
+                            Column('abbreviation', String(3), primary_key=True))
+    tables['players'] = Table('players', metadata, Column('player_id', String(16), primary_key=True))
+    tables['referees'] = Table('referees', metadata, Column('ref_id', String(16), primary_key=True),
+                               Column('name', String(64)))
+    tables['games'] = Table('games', metadata, Column('game_id', String(16), primary_key=True),
+                            Column('home_team_id', Integer, index=True), Column('away_team_id', Integer, index=True),
+                            Column('home_score', Float), Column('away_score', Float), Column('num_ot', Integer),
+                            Column('game_length', String(8)))
+    tables['refs'] = Table('game_refs', metadata, Column('game_id', String(16), primary_key=True),
+                           Column('ref_id', String(16), primary_key=True, index=True))
+    tables['playerStats'] = Table('player_boxscores', metadata, Column('game_id', String(16), primary_key=True),
+                                  Column('player_id', String(16), primary_key=True, index=True),
+                                  Column('team_id', Integer, index=True), Column('mp', String(8)),
+                                  *(stats(BOXSCORE_STATS) + [Column('home', Integer)]))
+    tables['teamStats'] = Table('team_boxscores', metadata, Column('game_id', String(16), primary_key=True),
+                                Column('team_id', Integer, primary_key=True, index=True), Column('mp', Float),
+                                *(stats(BOXSCORE_STATS) + [Column('home', Integer)]))
+    tables['fourFactors'] = Table('four_factors', metadata, Column('game_id', String(16), primary_key=True),
+                                  Column('team_id', Integer, primary_key=True, index=True),
+                                  *(stats(['Pace', 'eFG%', 'TOV%', 'ORB%', 'FT/FGA', 'ORtg']) +
+                                    [Column('home', Integer)]))
+    tables['finalScores'] = Table('final_scores', metadata, Column('game_id', String(16), primary_key=True),
+                                  Column('team_id', Integer, primary_key=True, index=True),
+                                  *(stats(['1', '2', '3', '4', 'OT', 'T']) +
+                                    [Column('num_ot', Integer), Column('home', Integer)]))
+    pbp_columns = [Column('game_id', String(16), primary_key=True), Column('play_id', Integer, primary_key=True),
+                   Column('period', Integer)]
+    pbp_columns += [Column(c, Float) for c in ['time_remaining', 'time_elapsed', 'play_length']]
+    pbp_columns += [Column('home_team_id', Integer, index=True), Column('away_team_id', Integer, index=True),
+                    Column('home_score', Float), Column('away_score', Float), Column('player_team_id', Integer),
+                    Column('pts', Integer), Column('possession_id', Integer), Column('offense_team_id', Integer)]
+    pbp_columns += [Column(sql_name(c), String(16) if c != 'details' else Text) for c in PBP_STRING_COLUMNS]
+    tables['pbp'] = Table('play_by_play', metadata, *pbp_columns)
+    Index('ix_play_by_play_player_id', tables['pbp'].c.player_id)
+    tables['shots'] = Table('shots', metadata, Column('game_id', String(16), primary_key=True),
+                            Column('shot_id', Integer, primary_key=True), Column('team_id', Integer, index=True),
+                            Column('player_id', String(16), index=True), Column('period', Integer),
+                            Column('time_remaining', Float), Column('x', Integer), Column('y', Integer),
+                            Column('shot_type', String(8)), Column('result', String(8)), Column('distance', Integer),
+                            Column('play_id', Integer))
+    tables['possessions'] = Table('possessions', metadata, Column('game_id', String(16), primary_key=True),
+                                  Column('possession_id', Integer, primary_key=True), Column('period', Integer),
+                                  Column('time_remaining', Float), Column('offense_team_id', Integer, index=True),
+                                  Column('defense_team_id', Integer, index=True),
+                                  *[Column(sql_name(c), Float if c == 'seconds' else Integer)
+                                    for c in POSSESSION_COLUMNS[6:]])
+    tables['stints'] = Table('stints', metadata, Column('game_id', String(16), primary_key=True),
+                             Column('stint_id', Integer, primary_key=True), Column('period', Integer),
+                             Column('time_remaining', Float), Column('home_team_id', Integer, index=True),
+                             Column('away_team_id', Integer, index=True),
+                             *([Column(sql_name(c), String(16)) for c in HOME_SLOTS + AWAY_SLOTS] +
+                               [Column(c, Float) for c in ['seconds', 'home_pts', 'away_pts', 'home_poss',
+                                                            'away_poss']]))
+    return tables
+
+
+# frame -> list of dicts keyed by sql column name for an executemany insert, NaN becomes NULL and columns the table
+# doesn't have are dropped
+def frame_to_records(frame, table):
+    frame = frame.rename(columns=lambda c: 'mp' if c == 'MP' else sql_name(c))
+    frame = frame[[c for c in frame.columns if c in table.c]]
+    frame = frame.astype(object).where(frame.notnull(), None)
+    records = frame.to_dict('records')
+    for c in frame.columns:
+        if isinstance(table.c[c].type, String):
+            for r in records:
+                if r[c] is not None and not isinstance(r[c], str):
+                    r[c] = str(r[c])
+    return records
+
+
+# writes scraped games into a relational database with the same write_game / flush / close interface as ResultSink
+# games are buffered and each batch goes in with one executemany insert per table inside a single transaction
+# re-written games replace their old rows
+class SqlStore(object):
+    def __init__(self, url=SQL_URL, batch_games=SINK_BATCH_GAMES, on_flush=None):
+        self.on_flush = on_flush
+        if url.startswith('sqlite:///'):
+            directory = os.path.dirname(url[len('sqlite:///'):])
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+        self.engine = create_engine(url)
+        self.metadata = MetaData()
+        self.tables = build_sql_schema(self.metadata)
+        self.metadata.create_all(self.engine)
+        self.batch_games = batch_games
+        self.pending = []
+        with self.engine.connect() as conn:
+            self.known_players = set(r[0] for r in conn.execute(select(self.tables['players'].c.player_id)))
+            self.known_refs = set(r[0] for r in conn.execute(select(self.tables['referees'].c.ref_id)))
+            self.known_teams = set(r[0] for r in conn.execute(select(self.tables['teams'].c.abbreviation)))
+
+    def write_game(self, game_id, tables):
+        self.pending.append((game_id, tables))
+        if len(self.pending) >= self.batch_games:
+            self.flush()
+
+    def game_record(self, game_id, tables):
+        game = {'game_id': game_id}
+        scores = tables.get('finalScores')
+        if scores is not None and len(scores) == 2:
+            game['home_team_id'], game['away_team_id'] = [int(x) for x in get_team_id(scores)]
+            game['home_score'] = float(scores['T'][1])
+            game['away_score'] = float(scores['T'][0])
+            game['num_ot'] = int(scores['#OT'][0])
+        length = tables.get('gameLengths')
+        if length is not None and len(length):
+            game['game_length'] = str(length['GameLength'][0])
+        return game
+
+    def flush(self):
+        if not self.pending:
+            return
+        rows = dict((name, []) for name in self.tables)
+        # game ids to clear from each table before inserting, only tables the game brings new rows for
+        replace = dict((name, []) for name in self.tables)
+        new_players = set()
+        new_refs = {}
+        # a game only gets its games row, which is what marks it stored, once it has every default table. a
+        # partial bundle (a --tables backfill) only updates the row of a game that is stored already
+        full = set()
+        for game_id, tables in self.pending:
+            if full_game(tables):
+                full.add(game_id)
+            if 'finalScores' in tables or 'gameLengths' in tables:
+                rows['games'].append(self.game_record(game_id, tables))
+                replace['games'].append(game_id)
+            for name, frame in tables.items():
+                if name not in self.tables:
+                    continue
+                replace[name].append(game_id)
+                if frame is None or not len(frame):
+                    continue
+                frame = frame.copy()
+                frame['game_id'] = game_id
+                rows[name].extend(frame_to_records(frame, self.tables[name]))
+                if name == 'playerStats':
+                    new_players.update(frame['player_id'])
+                elif name == 'refs':
+                    new_refs.update(zip(frame['Refid'], frame['Name']))
+        with self.engine.begin() as conn:
+            if replace['games']:
+                # a bundle with only some of the games columns (e.g. a finalScores backfill) keeps the stored rest
+                games = self.tables['games']
+                query = select(games).where(games.c.game_id.in_(replace['games']))
+                stored = dict((r.game_id, dict(r._mapping)) for r in conn.execute(query))
+                empty = dict((c.name, None) for c in games.c)
+                rows['games'] = [dict(empty, **dict(stored.get(g['game_id'], {}), **g)) for g in rows['games']
+                                 if g['game_id'] in stored or g['game_id'] in full]
+            for name, game_ids in replace.items():
+                if game_ids:
+                    table = self.tables[name]
+                    conn.execute(table.delete().where(table.c.game_id.in_(game_ids)))
+            teams = [{'team_id': convert_name_to_team_id(abbreviation), 'abbreviation': abbreviation}
+                     for abbreviation in sorted(BASKETBALL_REFERENCE_TEAMS) if abbreviation not in self.known_teams]
+            if teams:
+                conn.execute(self.tables['teams'].insert(), teams)
+            players = [{'player_id': str(p)} for p in new_players - self.known_players]
+            if players:
+                conn.execute(self.tables['players'].insert(), players)
+            refs = [{'ref_id': r, 'name': n} for r, n in new_refs.items() if r not in self.known_refs]
+            if refs:
+                conn.execute(self.tables['referees'].insert(), refs)
+            for name, records in rows.items():
+                if records:
+                    conn.execute(self.tables[name].insert(), records)
+        self.known_teams.update(t['abbreviation'] for t in teams)
+        self.known_players.update(p['player_id'] for p in players)
+        self.known_refs.update(r['ref_id'] for r in refs)
+        flushed = [g for g, t in self.pending]
+        self.pending = []
+        if self.on_flush is not None:
+            self.on_flush(flushed)
+
+    def close(self):
+        self.flush()
+        self.engine.dispose()
+
+    # game ids already stored with every default table
+    def games(self):
+        with self.engine.connect() as conn:
+            stored = set(r[0] for r in conn.execute(select(self.tables['games'].c.game_id)))
+        return stored | set(g for g, t in self.pending if full_game(t))
+
+
+# local binary store for random access to single games, same write_game / flush / close interface as ResultSink
+# every table of a game is written as an arrow ipc stream appended to games.arrows and index.json maps
+# game_id -> table -> (offset, length). reads memory map the data file and open the stream in place, so pulling
+# one game is a slice of the map whatever the size of the store. play by play is stored in the compact encoding
+# and expanded again by read_game. re-written tables are appended again and the index points at the new copy,
+# compact() drops the stale bytes
+class GameStore(object):
+    def __init__(self, directory=GAME_STORE_DIR, batch_games=SINK_BATCH_GAMES, on_flush=None):
+        if pa is None:
+            raise ImportError('pyarrow is needed for the game store')
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, 'games.arrows')
+        self.index_path = os.path.join(directory, 'index.json')
+        self.batch_games = batch_games
+        self.on_flush = on_flush
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        self.pending = []
+        self.map = None
+
+    def write_game(self, game_id, tables):
+        self.pending.append((game_id, tables))
+        if len(self.pending) >= self.batch_games:
+            self.flush()
+
+    # serialises a table as an arrow ipc stream padded to 8 bytes so every stream in the file stays aligned
+    @staticmethod
+    def encode(name, frame):
+        frame = arrow_safe(frame)
+        if name in PBP_TABLE_NAMES:
+            frame = compact_play_by_play(frame)
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if name in PBP_TABLE_NAMES:
+            metadata = dict(table.schema.metadata)
+            metadata[b'pbp_dtypes'] = json.dumps(frame.attrs['pbp_dtypes']).encode()
+            table = table.replace_schema_metadata(metadata)
+        out = pa.BufferOutputStream()
+        with pa.ipc.new_stream(out, table.schema) as writer:
+            writer.write_table(table)
+        data = out.getvalue().to_pybytes()
+        return data + b'\0' * (-len(data) % 8)
+
+    def flush(self):
+        if not self.pending:
+            return
+        with open(self.data_path, 'ab') as f:
+            for game_id, tables in self.pending:
+                entry = dict(self.index.get(game_id, {}))
+                for name, frame in tables.items():
+                    if frame is None:
+                        continue
+                    data = self.encode(name, frame)
+                    entry[name] = [f.tell(), len(data)]
+                    f.write(data)
+                self.index[game_id] = entry
+            f.flush()
+            os.fsync(f.fileno())
+        self.write_index()
+        flushed = [g for g, t in self.pending]
+        self.pending = []
+        self.map = None
+        if self.on_flush is not None:
+            self.on_flush(flushed)
+
+    def write_index(self):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_path)
+
+    def close(self):
+        self.flush()
+        self.map = None
+
+    # game ids already stored with every default table
+    def games(self):
+        pending = {}
+        for g, t in self.pending:
+            pending.setdefault(g, set()).update(t)
+        return set(g for g in set(self.index) | set(pending)
+                   if full_game(pending.get(g, set()).union(self.index.get(g, ()))))
+
+    # one table of a game as an arrow table backed by the memory map (no copy), KeyError if it isn't stored
+    def read_arrow(self, game_id, name):
+        offset, length = self.index[game_id][name]
+        if self.map is None:
+            self.map = pa.memory_map(self.data_path, 'r')
+        return pa.ipc.open_stream(self.map.read_at(length, offset)).read_all()
+
+    # the tables of a game as a dict of table name -> DataFrame, all stored tables unless names are given
+    def read_game(self, game_id, names=None):
+        if names is None:
+            names = list(self.index[game_id])
+        frames = {}
+        for name in names:
+            table = self.read_arrow(game_id, name)
+            frame = table.to_pandas()
+            if table.schema.metadata and b'pbp_dtypes' in table.schema.metadata:
+                frame = expand_play_by_play(frame, json.loads(table.schema.metadata[b'pbp_dtypes']))
+            frames[name] = frame
+        return frames
+
+    # rewrites the data file with only the current copy of every game
+    def compact(self):
+        self.flush()
+        if not self.index:
+            return
+        if self.map is None:
+            self.map = pa.memory_map(self.data_path, 'r')
+        tmp = self.data_path + '.tmp'
+        index = {}
+        with open(tmp, 'wb') as f:
+            for game_id, entry in self.index.items():
+                index[game_id] = {}
+                for name, (offset, length) in entry.items():
+                    index[game_id][name] = [f.tell(), length]
+                    f.write(self.map.read_at(length, offset))
+            f.flush()
+            os.fsync(f.fileno())
+        self.map = None
+        os.replace(tmp, self.data_path)
+        self.index = index
+        self.write_index()
 
 
-def compare_boxscores(bs, pbpbs):
-    cols = pbpbs.columns
-    players = bs['player_id']
-    failures = pd.DataFrame()
-    for p in players:
-        try:
-            row1 = bs[bs['player_id'] == p]
-            row2 = pbpbs[pbpbs['player_id'] == p]
-            for c in cols:
-                val1 = row1.loc[:, c].values[0]
-                val2 = row2.loc[:, c].values[0]
-                if type('') == type(val1) and ':' in val1:
-                    time_low = int(val1[:val1.find(':')]) - 1
-                    time_high = int(val1[:val1.find(':')]) + 1
-                    test_time = int(val2[:val2.find(':')])
-                    if time_low > test_time or test_time > time_high:
-                        failures = failures.append(pd.Series([p, c, val1, val2]), ignore_index=True)
-                elif val1 != val2:
-                    failures = failures.append(pd.Series([p, c, val1, val2]), ignore_index=True)
-        except:
-            failures = failures.append(pd.Series([p, 0, 0, 0]), ignore_index=True)
-    if not failures.empty:
-        failures.columns = ['player_id', 'Category', 'BS', 'PBP']
-    return failures
-
-
-# takes in a link for the box score and stores all values in a SQL database
-def scrape_boxscore(link):
-    print('start scraping')
-    r = requests.get(link)
-    soup_bs = BeautifulSoup(r.text, 'html5lib')
-    refs = get_refs(soup_bs)
-    refs.loc[:, 'game_id'] = url_to_id(link)
-    print('refs complete')
-    # print(refs)
-
-    players, teams = get_boxscore_stats(soup_bs)
-    players.loc[:, 'game_id'] = url_to_id(link)
-    teams.loc[:, 'game_id'] = url_to_id(link)
-    print('players and teams complete')
-    # print(players)
-    # print(teams)
-
-    four_factors = get_four_factors(soup_bs)
-    four_factors.loc[:, 'game_id'] = url_to_id(link)
-    print('4factors complete')
-    # print(ff)
-
-    scores = get_final_scores(soup_bs)
-    scores.loc[:, 'game_id'] = url_to_id(link)
-    print('scores complete')
-    # print(scores)
-
-    length = get_game_length(soup_bs)
-    length.loc[:, 'game_id'] = url_to_id(link)
-    print('length complete')
-
-    # print(length)
-
-    r_int = random.randint(1, 5)
-    print('wait: ', r_int)
-    time.sleep(r_int)
-
-    play_by_play_link = boxscore_url_to_play_by_play(link)
-
-    r = requests.get(play_by_play_link)
-    soup_pbp = BeautifulSoup(r.text, 'html5lib')
-
-    home, away = get_team_id(scores)
-    starters = get_starters(players, home, away)
-    """
-    play_by_play = get_play_by_play(soup_pbp, starters, home, away)
-    play_by_play.loc[:, 'game_id'] = url_to_id(link)
-    print('play by play complete')
-    # print(Play_by_Play)
-    return refs, players, teams, four_factors, scores, length, play_by_play
-    """
-    return refs, players, teams, four_factors, scores, length
-
-
-
-refs = pd.DataFrame()
-playerStats = pd.DataFrame()
-teamStats = pd.DataFrame()
-fourFactors = pd.DataFrame()
-finalScores = pd.DataFrame()
-gameLengths = pd.DataFrame()
-
-boxscores = pickle.load(open("boxscores.p", "rb"))
-for i, b in enumerate(boxscores):
-    refBS, playerBS, teamsBS, ffBS, scoresBS, lengthBS = scrape_boxscore(b)
-    refs = refs.append(refBS, ignore_index=True)
-    playerStats = playerStats.append(playerBS, ignore_index=True)
-    teamStats = teamStats.append(teamsBS, ignore_index=True)
-    fourFactors = fourFactors.append(ffBS, ignore_index=True)
-    finalScores = finalScores.append(scoresBS, ignore_index=True)
-    gameLengths = gameLengths.append(lengthBS, ignore_index=True)
-
-    if (i % 1200) == 0:
-        refs.to_csv("Scrape Results/refs.csv")
-        playerStats.to_csv("Scrape Results/playerStats.csv")
-        teamStats.to_csv("Scrape Results/teamStats.csv")
-        fourFactors.to_csv("Scrape Results/fourFactors.csv")
-        finalScores.to_csv("Scrape Results/finalScores.csv")
-        gameLengths.to_csv("Scrape Results/gameLengths.csv")
-
-    if (i + 1) % 1200 == 0:
-        R = random.randint(600, 900)
-        print('wait: ', R)
-        time.sleep(R)
-    else:
-        R = random.randint(2, 6)
-        print('wait: ', R)
-        time.sleep(R)
-
-
-"""
-with open('Scrape Results/fail.p', 'rb') as handle:
-        bs = pickle.load(handle)
-for i, test in enumerate(bs):
-    test = bs[2]
-    print(i)
-    print(test)
-    refs, players, teams, ff, scores, length, Play_by_Play = scrape_boxscore(test)
-    R = random.randint(5, 15)
-    print('wait: ', R)
-    time.sleep(R)
-"""
-
-"""
-boxscores = pickle.load(open("boxscores.p", "rb"))
-issues = pickle.load(open("Scrape Results/fail.p", "rb"))
-finished = pickle.load(open("Scrape Results/finishedBS.p", "rb"))
-pbpError = []
-for f in issues:
-    pbpError.append(f[0])
-
-errors = list(OrderedSet(boxscores) - OrderedSet(finished) - OrderedSet(pbpError))
-print(len(errors))
-i = 0
-#for b in errors:
-b = errors[19]
-print(b)
-print(i)
-# try:
-refBS, playerBS, teamsBS, ffBS, scoresBS, lengthBS, play_by_play_frame = scrape_boxscore(b)
-play_by_play_frame.to_csv('test.csv')
-pbp_bs = generate_bs_from_pbp(play_by_play_frame)
-
-fail = compare_boxscores(playerBS, pbp_bs)
-print('scrape complete')
-print(fail)
-i += 1
-"""
-"""
-refs = pd.DataFrame()
-playerStats = pd.DataFrame()
-teamStats = pd.DataFrame()
-fourFactors = pd.DataFrame()
-finalScores = pd.DataFrame()
-gameLengths = pd.DataFrame()
-playByPlay = pd.DataFrame()
-
-
-playByPlay_to_fix = pd.DataFrame()
-
-
-compare_failures = []
-compare_fail_count = 1
-
-error_failures = []
-error_fail_count = 1
-
-finished = []
-
-bs = pickle.load(open("boxscores.p", "rb"))
-for i, b in enumerate(bs):
-    print(i)
-    print(b)
-    try:
-        refBS, playerBS, teamsBS, ffBS, scoresBS, lengthBS, PBP = scrape_boxscore(b)
-        pbpbs = generate_bs_from_pbp(PBP)
-        fail = compare_boxscores(playerBS, pbpbs)
-
-        refs = refs.append(refBS, ignore_index=True)
-        playerStats = playerStats.append(playerBS, ignore_index=True)
-        teamStats = teamStats.append(teamsBS, ignore_index=True)
-        fourFactors = fourFactors.append(ffBS, ignore_index=True)
-        finalScores = finalScores.append(scoresBS, ignore_index=True)
-        gameLengths = gameLengths.append(lengthBS, ignore_index=True)
-
-        if (i) % 1200 == 0:
-            refs.to_csv("Scrape Results/refs.csv")
-            playerStats.to_csv("Scrape Results/playerStats.csv")
-            teamStats.to_csv("Scrape Results/teamStats.csv")
-            fourFactors.to_csv("Scrape Results/fourFactors.csv")
-            finalScores.to_csv("Scrape Results/finalScores.csv")
-            gameLengths.to_csv("Scrape Results/gameLengths.csv")
+#################################################################################################################
+#                                                                                                               #
+#                                           Rollups                                                             #
+#                                                                                                               #
+#################################################################################################################
 
-        if fail.empty:
-            print('No Failure')
-            playByPlay = playByPlay.append(PBP, ignore_index=True)
-            playByPlay.to_csv("Scrape Results/pbp.csv")
-        else:
-            print('Failure number {0}, appending failures to failure list'.format(compare_fail_count))
-            print(fail)
-            playByPlay_to_fix = playByPlay_to_fix.append(PBP, ignore_index=True)
-            compare_fail_count +=1
-            compare_failures.append((b, fail))
-            pickle.dump(compare_failures, open("Scrape Results/fail.p", "wb"))
-            playByPlay_to_fix.to_csv("Scrape Results/pbpToFix.csv")
-        finished.append(b)
-        if i % 200 == 0:
-            with open("Scrape Results/finishedBS.p", "wb") as file2:
-                pickle.dump(finished, file2)
-            file2.close()
 
-    except:
-        error_failures.append(b)
-        print('Error in scraping, Error number: ', error_fail_count)
-        error_fail_count += 1
-        e = sys.exc_info()
-        with open('Scrape Results/exceptions.txt', 'a') as file:
-            file.write("Error number {0}: {1}\n" .format(error_fail_count, e))
-        file.close()
-
-    print('dump complete')
-    if (i + 1) % 1200 == 0:
-        R = random.randint(600, 900)
-        print('wait: ', R)
-        time.sleep(R)
-    else:
-        R = random.randint(2, 6)
-        print('wait: ', R)
-        time.sleep(R)
+# box score columns the rollup sums, percentages and per game numbers are worked out from the sums when read
+ROLLUP_STATS = ['FG', 'FGA', '3P', '3PA', 'FT', 'FTA', 'ORB', 'DRB', 'TRB', 'AST', 'STL', 'BLK', 'TOV', 'PF', 'PTS',
+                '+/-']
+ROLLUP_LEVELS = {'team': ['player_id', 'season', 'team_id'], 'season': ['player_id', 'season'],
+                 'career': ['player_id']}
+
+
+# adds shooting percentages, minutes and, with per_game, per game averages to a frame of summed ROLLUP_STATS
+def rollup_ratios(frame, per_game=False):
+    frame['MP'] = frame['seconds'] / 60
+    frame['FG%'] = frame['FG'] / frame['FGA'].where(frame['FGA'] > 0)
+    frame['3P%'] = frame['3P'] / frame['3PA'].where(frame['3PA'] > 0)
+    frame['FT%'] = frame['FT'] / frame['FTA'].where(frame['FTA'] > 0)
+    frame['eFG%'] = (frame['FG'] + 0.5 * frame['3P']) / frame['FGA'].where(frame['FGA'] > 0)
+    shots = frame['FGA'] + 0.44 * frame['FTA']
+    frame['TS%'] = frame['PTS'] / (2 * shots.where(shots > 0))
+    if per_game:
+        games = frame['G'].where(frame['G'] > 0)
+        for c in ['MP'] + ROLLUP_STATS:
+            frame[c] = frame[c] / games
+    return frame.drop(columns='seconds')
+
+
+# materialised player totals keyed by player_id x season x team_id in a sqlite file
+# add() folds the playerStats rows of new games into the totals with one upsert per key, games already added are
+# skipped so re-scraped or retried games are never counted twice. G counts games with minutes played
+# totals() reads the rows back at the team, season (all teams of a season) or career level
+class PlayerRollup(object):
+    def __init__(self, path=ROLLUP_PATH):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.columns = ['G', 'seconds'] + [sql_name(c) for c in ROLLUP_STATS]
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS player_totals (player_id TEXT NOT NULL, season INTEGER NOT NULL, '
+                          'team_id INTEGER NOT NULL, {0}, PRIMARY KEY (player_id, season, team_id))'.format(
+                              ', '.join('{0} REAL NOT NULL DEFAULT 0'.format(c) for c in self.columns)))
+        self.conn.execute('CREATE INDEX IF NOT EXISTS ix_player_totals_season ON player_totals (season, team_id)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS rollup_games (game_id TEXT PRIMARY KEY)')
+        self.conn.commit()
+        self.lock = threading.Lock()
+
+    def games(self):
+        return set(r[0] for r in self.conn.execute('SELECT game_id FROM rollup_games'))
+
+    # players is a playerStats frame (get_boxscore_stats layout with game_id) of one game or many
+    # returns the number of games added
+    def add(self, players):
+        if players is None or not len(players):
+            return 0
+        with self.lock:
+            known = self.games()
+            players = players[~players['game_id'].isin(known)]
+            game_ids = list(players['game_id'].unique())
+            if not game_ids:
+                return 0
+            seconds = minutes_to_seconds(players['MP'])
+            rows = pd.DataFrame({'player_id': players['player_id'].astype(str).values,
+                                 'season': players['game_id'].map(lambda g: game_partition(g)[0]).values,
+                                 'team_id': players['team_id'].astype(int).values,
+                                 'G': seconds.notnull().astype(int).values, 'seconds': seconds.fillna(0).values})
+            for c in ROLLUP_STATS:
+                rows[sql_name(c)] = pd.to_numeric(players[c], errors='coerce').fillna(0).values
+            rows = rows.groupby(['player_id', 'season', 'team_id'], as_index=False).sum()
+            names = ['player_id', 'season', 'team_id'] + self.columns
+            upsert = 'INSERT INTO player_totals ({0}) VALUES ({1}) ON CONFLICT (player_id, season, team_id) ' \
+                     'DO UPDATE SET {2}'.format(', '.join(names), ', '.join('?' * len(names)),
+                                                ', '.join('{0} = {0} + excluded.{0}'.format(c) for c in self.columns))
+            self.conn.executemany(upsert, [tuple(r) for r in rows[names].itertuples(index=False)])
+            self.conn.executemany('INSERT INTO rollup_games (game_id) VALUES (?)', [(g,) for g in game_ids])
+            self.conn.commit()
+            return len(game_ids)
+
+    # adds every game of a ResultSink's playerStats parts, for building the rollup from an earlier scrape
+    def add_sink(self, sink):
+        added = 0
+        for _, players in sink.read_parts('playerStats'):
+            added += self.add(players)
+        return added
+
+    # rollup rows at level 'team' (player x season x team), 'season' or 'career', optionally only for some players
+    # or seasons, with per_game the counting stats and minutes are per game played
+    def totals(self, level='team', per_game=False, player_ids=None, seasons=None):
+        query = 'SELECT * FROM player_totals'
+        where = []
+        params = []
+        for column, values in (('player_id', player_ids), ('season', seasons)):
+            if values is not None:
+                values = list(values)
+                where.append('{0} IN ({1})'.format(column, ','.join('?' * len(values))))
+                params += values
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        frame = pd.read_sql_query(query, self.conn, params=params)
+        frame = frame.rename(columns=dict((sql_name(c), c) for c in ROLLUP_STATS))
+        keys = ROLLUP_LEVELS[level]
+        frame = frame.groupby(keys, as_index=False)[['G', 'seconds'] + ROLLUP_STATS].sum()
+        return rollup_ratios(frame, per_game)
+
+    def close(self):
+        self.conn.close()
 
 
-"""
+#################################################################################################################
+#                                                                                                               #
+#                                           Schedule                                                            #
+#                                                                                                               #
+#################################################################################################################
 
-"""
-    except:
-        print('Failed on Boxscore: ', b)
-        print('{0} failures so so far'.format(failcount))
-        failures.append(b)
-        failcount += 1
-        pickle.dump(failures, open("Scrape Results/fail.p", "wb"))
-"""
-"""
-with open('boxscores.p', 'rb') as handle:
-        bs = pickle.load(handle)
-
-b = bs[0]
-print(b)
-refBS, playerBS, teamsBS, ffBS, scoresBS, lengthBS, PBP = scrape_boxscore(b)
-PBPBS = generate_bs_from_pbp(PBP)
-failures = compare_boxscores(playerBS, PBPBS)
-print(failures)
-"""
\ No newline at end of file
+
+# basketball-reference code of every team name in the schedule, relocated and renamed franchises keep the code
+# basketball-reference used for that name (Seattle SuperSonics = SEA, Charlotte Hornets before 2002 = CHH, ..)
+SCHEDULE_TEAM_CODES = {'Atlanta Hawks': 'ATL', 'Boston Celtics': 'BOS', 'Brooklyn Nets': 'BRK',
+                       'Charlotte Bobcats': 'CHA', 'Charlotte Hornets': 'CHH', 'Chicago Bulls': 'CHI',
+                       'Cleveland Cavaliers': 'CLE', 'Dallas Mavericks': 'DAL', 'Denver Nuggets': 'DEN',
+                       'Detroit Pistons': 'DET', 'Golden State Warriors': 'GSW', 'Houston Rockets': 'HOU',
+                       'Indiana Pacers': 'IND', 'Los Angeles Clippers': 'LAC', 'Los Angeles Lakers': 'LAL',
+                       'Memphis Grizzlies': 'MEM', 'Miami Heat': 'MIA', 'Milwaukee Bucks': 'MIL',
+                       'Minnesota Timberwolves': 'MIN', 'New Jersey Nets': 'NJN', 'New Orleans Hornets': 'NOH',
+                       'New Orleans Pelicans': 'NOP', 'New Orleans/Oklahoma City Hornets': 'NOK',
+                       'New York Knicks': 'NYK', 'Oklahoma City Thunder': 'OKC', 'Orlando Magic': 'ORL',
+                       'Philadelphia 76ers': 'PHI', 'Phoenix Suns': 'PHO', 'Portland Trail Blazers': 'POR',
+                       'Sacramento Kings': 'SAC', 'San Antonio Spurs': 'SAS', 'Seattle SuperSonics': 'SEA',
+                       'Toronto Raptors': 'TOR', 'Utah Jazz': 'UTA', 'Vancouver Grizzlies': 'VAN',
+                       'Washington Bullets': 'WSB', 'Washington Wizards': 'WAS'}
+
+
+# reads the season schedule and returns one row per game with its game_id and boxscore url added
+# basketball-reference names a boxscore after the date and the home team: 201404160SAS = San Antonio at home on
+# 2014-04-16. seasons optionally limits the schedule to a list of seasons (the year a season ends)
+def load_schedule(path=SCHEDULE_PATH, seasons=None):
+    schedule = pd.read_csv(path, index_col=0)
+    if seasons is not None:
+        schedule = schedule[schedule['Season'].isin(seasons)]
+    unknown = set(schedule['Home']) - set(SCHEDULE_TEAM_CODES)
+    if unknown:
+        raise ValueError('no basketball-reference code for {0}'.format(', '.join(sorted(unknown))))
+    dates = pd.to_datetime(schedule['Date'], format='%a %b %d %Y')
+    schedule = schedule.assign(game_id=dates.dt.strftime('%Y%m%d') + '0' + schedule['Home'].map(SCHEDULE_TEAM_CODES))
+    schedule['url'] = schedule['game_id'].map(BOXSCORE_URL.format)
+    return schedule.drop_duplicates('game_id').reset_index(drop=True)
+
+
+# boxscore urls of the scheduled games that aren't in stored yet, in schedule order
+# stored is a collection of game ids, e.g. sink.games() of a ResultSink, GameStore or SqlStore
+def missing_games(schedule, stored):
+    stored = set(stored)
+    return [url for game_id, url in zip(schedule['game_id'], schedule['url']) if game_id not in stored]
+
+
+# boxscore urls for an incremental update: scheduled games from since up to until (dates or 'YYYY-MM-DD' strings)
+# that aren't stored yet. since defaults to the day of the latest stored game so a missed night is picked up on the
+# next run, until defaults to yesterday because tonight's box scores aren't final yet
+def games_to_update(schedule, stored, since=None, until=None):
+    stored = set(stored)
+    dates = pd.to_datetime(schedule['game_id'].str[:8], format='%Y%m%d')
+    if until is None:
+        until = pd.Timestamp.today().normalize() - pd.Timedelta(days=1)
+    keep = dates <= pd.Timestamp(until)
+    if since is None:
+        stored_dates = dates[schedule['game_id'].isin(stored)]
+        if len(stored_dates):
+            since = stored_dates.max()
+    if since is not None:
+        keep &= dates >= pd.Timestamp(since)
+    return missing_games(schedule[keep], stored)
+
+
+#################################################################################################################
+#                                                                                                               #
+#                                           Job ledger                                                          #
+#                                                                                                               #
+#################################################################################################################
+
+
+JOB_STATES = ('pending', 'fetched', 'parsed', 'validated', 'failed')
+
+
+# durable record of where every boxscore url is in the pipeline, kept in sqlite
+# each state change is a single row update on the url primary key, so recording progress costs the same at game 7000
+# as at game 1 and a crash loses nothing that was recorded
+class JobLedger(object):
+    def __init__(self, path=LEDGER_PATH):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS jobs (url TEXT PRIMARY KEY, state TEXT NOT NULL, '
+                          'attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS ix_jobs_state ON jobs (state)')
+        self.conn.commit()
+        self.lock = threading.Lock()
+
+    # adds urls as pending, urls already in the ledger keep their state
+    def add(self, urls):
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO jobs (url, state, updated) VALUES (?, 'pending', ?)",
+                                  [(u, time.time()) for u in urls])
+            self.conn.commit()
+
+    def set_state(self, url, state, error=None):
+        self.set_states([url], state, error)
+
+    def set_states(self, urls, state, error=None):
+        if state not in JOB_STATES:
+            raise ValueError('unknown job state {0}'.format(state))
+        attempt = 1 if state == 'fetched' else 0
+        with self.lock:
+            self.conn.executemany('UPDATE jobs SET state = ?, error = ?, attempts = attempts + ?, updated = ? '
+                                  'WHERE url = ?', [(state, error, attempt, time.time(), u) for u in urls])
+            self.conn.commit()
+
+    def state(self, url):
+        row = self.conn.execute('SELECT state FROM jobs WHERE url = ?', (url,)).fetchone()
+        return row[0] if row else None
+
+    # urls still to do in the order they were added: every job not in a finished state, failed jobs only when
+    # retry_failed is set, and only urls in urls when it is given
+    def todo(self, finished=('parsed', 'validated'), retry_failed=False, urls=None):
+        done = list(finished) + ([] if retry_failed else ['failed'])
+        query = 'SELECT url FROM jobs WHERE state NOT IN ({0}) ORDER BY rowid'.format(','.join('?' * len(done)))
+        todo = [r[0] for r in self.conn.execute(query, done)]
+        if urls is not None:
+            wanted = set(urls)
+            todo = [u for u in todo if u in wanted]
+        return todo
+
+    def counts(self):
+        return dict(self.conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+
+    def failures(self):
+        return self.conn.execute("SELECT url, error FROM jobs WHERE state = 'failed' ORDER BY rowid").fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+# parses one game's downloaded pages into a result bundle, this is what the parse worker processes run
+# the bundle holds the game's tables for the sink and the ledger state to record (failed with the error text when
+# scraping raises or, with validate, when the play by play doesn't match the box score)
+# tables are the tables to scrape (default BOXSCORE_TABLE_NAMES), pages has to hold every page they need (see
+# table_pages). with validate the play by play is scraped and checked too, validated games also store it with its
+# lineup stints (get_stints) and possessions (get_possessions), games that don't match store it as pbpToFix
+# shots are optional: a game without a shot chart page (404) just has no shots table, any other error fetching or
+# building the shots (or the play by play they are joined to) is recorded as shots_error and the rest is stored
+def parse_game(link, pages, validate=False, tables=None):
+    timings = {}
+    bundle = {'link': link, 'game_id': url_to_id(link), 'tables': {}, 'state': 'parsed', 'error': None,
+              'shots_error': None, 'timings': timings}
+    names = [name for name in tables or BOXSCORE_TABLE_NAMES if name != 'shots']
+    shots = 'shots' in (tables or ())
+    game = GameTables(link, pages, timings=timings)
+    try:
+        game.plan(names + (['pbp'] if validate else []))
+        for name in names:
+            game.get(name)
+        if validate:
+            players = game.get('playerStats')
+            pbp = game.get('pbp')
+    except Exception:
+        bundle['state'] = 'failed'
+        bundle['error'] = traceback.format_exc()
+        return bundle
+    if shots and isinstance(pages.get('shotchart'), Exception):
+        if not missing_page(pages['shotchart']):
+            bundle['shots_error'] = repr(pages['shotchart'])
+    elif shots and 'shotchart' in pages:
+        try:
+            game.get('shots')
+        except Exception:
+            bundle['shots_error'] = traceback.format_exc()
+    if validate:
+        with timed(timings, 'derived_boxscore'):
+            pbpbs = generate_bs_from_pbp(pbp)
+        with timed(timings, 'compare'):
+            fail = compare_boxscores(players, pbpbs)
+        if fail.empty:
+            game.get('stints')
+            game.get('possessions')
+            names += [name for name in ('pbp', 'stints', 'possessions') if name not in names]
+            bundle['state'] = 'validated'
+        else:
+            names = [name for name in names if name not in ('pbp', 'stints', 'possessions')]
+            bundle['state'] = 'failed'
+            bundle['error'] = 'box score mismatch:\n' + fail.to_string()
+    result = dict((name, game.tables[name]) for name in names)
+    if 'shots' in game.tables:
+        result['shots'] = game.tables['shots']
+    if validate and not fail.empty:
+        result['pbpToFix'] = pbp
+        result['compareFailures'] = fail
+    bundle['tables'] = result
+    return bundle
+
+
+# scrapes every url not yet finished in the ledger and writes the results through sink
+# downloads run in the fetcher's threads and feed a bounded set of parse jobs on parse_workers processes (0 parses
+# in this process), finished bundles come back here and this process alone writes the sink and the ledger
+# the ledger records fetched as soon as a game's pages arrive and failed (with the traceback) on any error, the
+# parsed / validated state is only recorded once the sink has flushed the game so a crash never marks unsaved
+# games as done. with validate the play by play is scraped and checked against the box score, games that don't
+# match are stored under pbpToFix / compareFailures and marked failed
+# metrics optionally collects the stage times of every game, its rows per table and how long the loop waited on
+# its pages (fetch_wait). tables are the tables to scrape (default BOXSCORE_TABLE_NAMES), only the pages they need
+# are downloaded. with shotchart the shot chart is scraped too and stored as the shots table
+# rollup is an optional PlayerRollup every game's player box score is added to as it is written
+def run_scrape(urls, sink, ledger, fetcher, validate=False, retry_failed=False, parse_workers=PARSE_WORKERS,
+               metrics=None, shotchart=False, rollup=None, tables=None):
+    tables = list(tables or BOXSCORE_TABLE_NAMES) + (['shots'] if shotchart else [])
+    page_names = table_pages(tables + (['pbp'] if validate else []))
+    ledger.add(urls)
+    # a validated game is parsed as well, only a validating run has to redo games that were just parsed
+    finished = ('validated',) if validate else ('parsed', 'validated')
+    todo = ledger.todo(finished=finished, retry_failed=retry_failed, urls=urls)
+    print('{0} of {1} games to scrape'.format(len(todo), len(urls)))
+    unflushed = {}
+    fetch_waits = {}
+
+    def flushed(game_ids):
+        for state in ('parsed', 'validated'):
+            done = [unflushed[g][0] for g in game_ids if g in unflushed and unflushed[g][1] == state]
+            if done:
+                ledger.set_states(done, state)
+        for g in game_ids:
+            unflushed.pop(g, None)
+    sink.on_flush = flushed
+
+    def write(bundle):
+        if metrics is not None:
+            metrics.add_game(bundle['game_id'], bundle['timings'], bundle['tables'], bundle['state'],
+                             fetch_waits.pop(bundle['game_id'], None))
+        if bundle['shots_error'] is not None:
+            print('No shots: ', bundle['link'], bundle['shots_error'].strip().splitlines()[-1])
+            if metrics is not None:
+                metrics.count('shot_errors')
+        if bundle['state'] == 'failed':
+            print('Failed: ', bundle['link'])
+            ledger.set_state(bundle['link'], 'failed', bundle['error'])
+        else:
+            unflushed[bundle['game_id']] = (bundle['link'], bundle['state'])
+        # a parsed game with no tables (only shots asked for and no shot chart page) still goes through the sink
+        # so its ledger state is set on flush like any other
+        if bundle['tables'] or bundle['state'] != 'failed':
+            sink.write_game(bundle['game_id'], bundle['tables'])
+        if rollup is not None and 'playerStats' in bundle['tables']:
+            rollup.add(bundle['tables']['playerStats'])
+
+    pool = ProcessPoolExecutor(parse_workers) if parse_workers else None
+    in_flight = set()
+    for (b, pages), waited in timed_iter(fetcher.iter_games(todo, pages=page_names)):
+        if isinstance(pages, Exception):
+            print('Failed to fetch: ', b, pages)
+            ledger.set_state(b, 'failed', repr(pages))
+            if metrics is not None:
+                metrics.add_game(url_to_id(b), {}, state='failed', fetch_wait=waited)
+            continue
+        fetch_waits[url_to_id(b)] = waited
+        ledger.set_state(b, 'fetched')
+        if pool is None:
+            write(parse_game(b, pages, validate, tables))
+            continue
+        # keep at most two games per worker queued so pages don't pile up in memory
+        while len(in_flight) >= parse_workers * 2:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for f in done:
+                write(f.result())
+        in_flight.add(pool.submit(parse_game, b, pages, validate, tables))
+    if pool is not None:
+        for f in wait(in_flight)[0]:
+            write(f.result())
+        pool.shutdown()
+    sink.close()
+    print(ledger.counts())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='scrape basketball-reference box scores')
+    parser.add_argument('--sql', action='store_true', help='write to the sql store instead of csv part files')
+    parser.add_argument('--game-store', action='store_true', help='write to the indexed game store instead of csv '
+                                                                  'part files')
+    parser.add_argument('--validate', action='store_true', help='scrape the play by play and check it against the '
+                                                                   'box score')
+    parser.add_argument('--shots', action='store_true', help='also scrape the shot chart of every game')
+    parser.add_argument('--tables', nargs='+', choices=SCRAPE_TABLE_NAMES, metavar='TABLE',
+                        help='only scrape these tables ({0}) for every scheduled game, for backfilling tables the '
+                             'results do not hold yet. progress is kept in a ledger of its own'.format(
+                                 ', '.join(SCRAPE_TABLE_NAMES)))
+    parser.add_argument('--retry-failed', action='store_true', help='retry games that failed on an earlier run')
+    parser.add_argument('--offline', action='store_true', help='only use pages already in the page cache')
+    parser.add_argument('--parse-workers', type=int, default=PARSE_WORKERS, help='parser processes, 0 parses in '
+                                                                                 'the main process')
+    parser.add_argument('--seasons', type=int, nargs='+', help='only scrape these seasons (the year a season ends)')
+    parser.add_argument('--update', action='store_true', help='only scrape and validate games played since the '
+                                                              'latest stored game, up to yesterday')
+    parser.add_argument('--since', help='with --update, start from this date (YYYY-MM-DD) instead')
+    parser.add_argument('--urls', help='pickled list of boxscore urls to scrape instead of the season schedule')
+    parser.add_argument('--rollup', action='store_true', help='keep the player season / career rollup up to date')
+    parser.add_argument('--metrics', help='append per game stage timings to this json lines file')
+    parser.add_argument('--prometheus', help='write the run totals to this file in prometheus text format')
+    parser.add_argument('--export-parquet', action='store_true', help='export the csv / parquet parts as parquet '
+                                                                      'partitioned by season and home team')
+    args = parser.parse_args()
+
+    metrics = Metrics() if args.metrics or args.prometheus else None
+    fetcher = PageFetcher(cache=PageCache(), offline=args.offline, metrics=metrics)
+    if args.sql:
+        sink = SqlStore()
+    elif args.game_store:
+        sink = GameStore()
+    else:
+        sink = ResultSink()
+    if args.urls:
+        boxscores = pickle.load(open(args.urls, "rb"))
+    elif args.update:
+        boxscores = games_to_update(load_schedule(seasons=args.seasons), sink.games(), since=args.since)
+    elif args.tables:
+        boxscores = missing_games(load_schedule(seasons=args.seasons), ())
+    else:
+        boxscores = missing_games(load_schedule(seasons=args.seasons), sink.games())
+    if args.tables:
+        ledger = JobLedger('{0}-{1}.db'.format(os.path.splitext(LEDGER_PATH)[0], '-'.join(sorted(args.tables))))
+    else:
+        ledger = JobLedger()
+    if args.retry_failed:
+        # failed games may have written tables (pbpToFix) so they don't show up as missing
+        listed = set(boxscores)
+        boxscores = boxscores + [u for u, error in ledger.failures() if u not in listed]
+    rollup = None
+    if args.rollup:
+        rollup = PlayerRollup()
+        # a new rollup starts from the games the csv / parquet parts already hold
+        if not rollup.games() and isinstance(sink, ResultSink):
+            rollup.add_sink(sink)
+    run_scrape(boxscores, sink, ledger, fetcher, validate=args.validate or args.update, retry_failed=args.retry_failed,
+               parse_workers=args.parse_workers, metrics=metrics, shotchart=args.shots, rollup=rollup,
+               tables=args.tables)
+    if rollup is not None:
+        rollup.close()
+    if args.metrics:
+        metrics.write_jsonl(args.metrics)
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
+    if args.export_parquet and isinstance(sink, ResultSink):
+        export_parquet(sink)
+    ledger.close()
+    fetcher.close()
@@ -0,0 +1,217 @@
+# offline benchmark for the extractors
+# every function runs over every game of the page corpus (or pages from the page cache) and the harness reports
+# latency percentiles per call and the peak memory allocated during one call. with --baseline it compares against
+# an earlier --json report and exits with status 1 when a function got slower or hungrier than the tolerance allows
+#
+#   python benchmark.py --json bench.json
+#   python benchmark.py --baseline bench.json --tolerance 1.25
+#   python benchmark.py --rows                 (adds play by play parser rows/sec)
+
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import BBRef_scrape as B
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'pages')
+PERCENTILES = (50, 90, 99)
+
+
+# loads (game_id, boxscore html, pbp html, shot chart html or None) for every game listed in corpus.json
+def load_corpus(directory=CORPUS_DIR):
+    with open(os.path.join(directory, 'corpus.json')) as f:
+        corpus = json.load(f)
+    games = []
+    for game in corpus['games']:
+        with open(os.path.join(directory, 'boxscores', game['game_id'] + '.html')) as f:
+            boxscore = f.read()
+        with open(os.path.join(directory, 'boxscores', 'pbp', game['game_id'] + '.html')) as f:
+            pbp = f.read()
+        shotchart = None
+        path = os.path.join(directory, 'boxscores', 'shot-chart', game['game_id'] + '.html')
+        if os.path.exists(path):
+            with open(path) as f:
+                shotchart = f.read()
+        games.append((game['game_id'], boxscore, pbp, shotchart))
+    return games
+
+
+# loads the same from a PageCache directory, for benchmarking real pages saved by earlier scrapes
+def load_cached(directory, game_ids):
+    cache = B.PageCache(directory)
+    games = []
+    for game_id in game_ids:
+        link = B.BOXSCORE_URL.format(game_id)
+        boxscore = cache.get(link)
+        pbp = cache.get(B.boxscore_url_to_play_by_play(link))
+        if boxscore is None or pbp is None:
+            raise IOError('{0} is not in the page cache'.format(game_id))
+        shotchart = cache.get(B.boxscore_url_to_shotchart(link))
+        games.append((game_id, boxscore[0], pbp[0], shotchart[0] if shotchart is not None else None))
+    return games
+
+
+# the calls to benchmark for one game as a list of (function name, zero argument callable)
+# inputs of every extractor are prepared up front so each call measures that function alone
+# the shot chart calls are only added for games that have a shot chart page
+def game_calls(game_id, boxscore, pbp, shotchart=None):
+    link = B.BOXSCORE_URL.format(game_id)
+    bs_page = B.parse_page(boxscore, B.BOXSCORE_TABLES)
+    pbp_page = B.parse_page(pbp, B.PBP_TABLES)
+    players = B.get_boxscore_stats(bs_page)[0]
+    home, away = B.get_team_id(B.get_final_scores(bs_page))
+    starters = B.get_starters(players, home, away)
+    plays = B.get_play_by_play(pbp_page, list(starters), home, away)
+    pbpbs = B.generate_bs_from_pbp(plays)
+    calls = [('parse_page boxscore', lambda: B.parse_page(boxscore, B.BOXSCORE_TABLES)),
+            ('parse_page pbp', lambda: B.parse_page(pbp, B.PBP_TABLES)),
+            ('get_refs', lambda: B.get_refs(bs_page)),
+            ('get_boxscore_stats', lambda: B.get_boxscore_stats(bs_page)),
+            ('get_four_factors', lambda: B.get_four_factors(bs_page)),
+            ('get_final_scores', lambda: B.get_final_scores(bs_page)),
+            ('get_game_length', lambda: B.get_game_length(bs_page)),
+            ('get_play_by_play', lambda: B.get_play_by_play(pbp_page, list(starters), home, away)),
+            ('generate_bs_from_pbp', lambda: B.generate_bs_from_pbp(plays)),
+            ('compare_boxscores', lambda: B.compare_boxscores(players, pbpbs)),
+            ('scrape_boxscore', lambda: B.scrape_boxscore(link, {'boxscore': boxscore, 'pbp': pbp},
+                                                          play_by_play=True)),
+            ('scrape_tables scores', lambda: B.scrape_tables(link, ['finalScores'], {'boxscore': boxscore}))]
+    if shotchart is not None:
+        plays['game_id'] = game_id
+        shots = B.get_shot_chart(shotchart)
+        shots['game_id'] = game_id
+        calls += [('get_shot_chart', lambda: B.get_shot_chart(shotchart)),
+                  ('join_shots_to_pbp', lambda: B.join_shots_to_play_by_play(shots, plays))]
+    return calls
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    k = (len(samples) - 1) * p / 100.0
+    low = int(k)
+    high = min(low + 1, len(samples) - 1)
+    return samples[low] + (samples[high] - samples[low]) * (k - low)
+
+
+# runs every call repeat times for the latencies and once more under tracemalloc for the memory peak
+# returns {function: {'calls': n, 'p50_ms': .., 'p90_ms': .., 'p99_ms': .., 'max_ms': .., 'peak_kb': ..}}
+def run_benchmark(games, repeat=20):
+    latencies = {}
+    peaks = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        calls = [call for game in games for call in game_calls(*game)]
+        for name, call in calls:
+            call()
+        for _ in range(repeat):
+            for name, call in calls:
+                start = time.perf_counter()
+                call()
+                latencies.setdefault(name, []).append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            for name, call in calls:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                call()
+                peaks[name] = max(peaks.get(name, 0), tracemalloc.get_traced_memory()[1] - base)
+        finally:
+            tracemalloc.stop()
+    report = {}
+    for name, samples in latencies.items():
+        stats = {'calls': len(samples)}
+        for p in PERCENTILES:
+            stats['p{0}_ms'.format(p)] = percentile(samples, p) * 1000
+        stats['max_ms'] = max(samples) * 1000
+        stats['peak_kb'] = peaks[name] / 1024.0
+        report[name] = stats
+    return report
+
+
+# throughput of the play by play parser in rows/sec: classify_event on its own over every play description and
+# then the full get_play_by_play
+def benchmark_play_by_play(games, repeat=10):
+    descriptions = []
+    inputs = []
+    for _, boxscore, pbp, _ in games:
+        bs_page = B.parse_page(boxscore, B.BOXSCORE_TABLES)
+        pbp_page = B.parse_page(pbp, B.PBP_TABLES)
+        for td in pbp_page['no_highlight stats_table'][0].iter('td'):
+            text = B.node_text(td)
+            if len(text) > 1:
+                descriptions.append(text)
+        players = B.get_boxscore_stats(bs_page)[0]
+        home, away = B.get_team_id(B.get_final_scores(bs_page))
+        inputs.append((pbp_page, B.get_starters(players, home, away), home, away))
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for details in descriptions:
+            B.classify_event(details)
+    classify_rate = len(descriptions) * repeat / (time.perf_counter() - start)
+
+    rows = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            for pbp_page, starters, home, away in inputs:
+                rows += len(B.get_play_by_play(pbp_page, list(starters), home, away))
+    return {'classify_event': classify_rate, 'get_play_by_play': rows / (time.perf_counter() - start)}
+
+
+def print_report(report, out=sys.stdout):
+    columns = ['calls'] + ['p{0}_ms'.format(p) for p in PERCENTILES] + ['max_ms', 'peak_kb']
+    out.write('{0:<22}'.format('function') + ''.join('{0:>10}'.format(c) for c in columns) + '\n')
+    for name, stats in report.items():
+        out.write('{0:<22}'.format(name) + '{0:>10}'.format(stats['calls']) +
+                  ''.join('{0:>10.2f}'.format(stats[c]) for c in columns[1:]) + '\n')
+
+
+# functions whose median latency or memory peak grew by more than tolerance times the baseline
+def regressions(report, baseline, tolerance=1.25):
+    found = []
+    for name, stats in report.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for key in ('p50_ms', 'peak_kb'):
+            if old[key] > 0 and stats[key] > old[key] * tolerance:
+                found.append('{0} {1}: {2:.2f} -> {3:.2f}'.format(name, key, old[key], stats[key]))
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='offline extractor benchmark')
+    parser.add_argument('--repeat', type=int, default=20, help='timed passes over the corpus')
+    parser.add_argument('--corpus', default=CORPUS_DIR, help='page corpus directory with a corpus.json')
+    parser.add_argument('--cache', help='benchmark pages from this page cache directory instead of the corpus')
+    parser.add_argument('--games', nargs='+', help='game ids to load from --cache')
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--baseline', help='report from an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='allowed slowdown / memory growth factor')
+    parser.add_argument('--rows', action='store_true', help='also report play by play parser rows/sec')
+    args = parser.parse_args()
+
+    if args.cache:
+        games = load_cached(args.cache, args.games or [])
+    else:
+        games = load_corpus(args.corpus)
+    report = run_benchmark(games, args.repeat)
+    print_report(report)
+    if args.rows:
+        for name, rate in benchmark_play_by_play(games, args.repeat).items():
+            print('{0:<22}{1:>10.0f} rows/s'.format(name, rate))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for line in found:
+            print('regression: ' + line)
+        if found:
+            sys.exit(1)
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BBRef_scrape as B
+
+
+# fetch_page stand in: the pbp page of game 2 is a 404, every other page comes back as its url
+def fake_fetch_page(url, *args, **kwargs):
+    if url.endswith('/pbp/g2.html'):
+        raise requests.HTTPError('404 for {0}'.format(url))
+    return url
+
+
+def test_iter_games_keeps_going_after_a_failed_fetch(monkeypatch):
+    monkeypatch.setattr(B, 'fetch_page', fake_fetch_page)
+    links = ['http://example.com/boxscores/g{0}.html'.format(i) for i in range(1, 7)]
+    fetcher = B.PageFetcher(max_workers=2)
+    try:
+        games = list(fetcher.iter_games(links, window=2))
+    finally:
+        fetcher.close()
+    assert [link for link, _ in games] == links
+    assert isinstance(games[1][1], requests.HTTPError)
+    for link, pages in games[:1] + games[2:]:
+        assert pages == {'boxscore': link, 'pbp': B.boxscore_url_to_play_by_play(link)}
+
+
+def test_iter_games_only_fetches_the_pages_asked_for(monkeypatch):
+    monkeypatch.setattr(B, 'fetch_page', fake_fetch_page)
+    links = ['http://example.com/boxscores/g{0}.html'.format(i) for i in range(1, 5)]
+    fetcher = B.PageFetcher(max_workers=2)
+    try:
+        games = list(fetcher.iter_games(links, window=2, pages=('boxscore',)))
+    finally:
+        fetcher.close()
+    assert [pages for _, pages in games] == [{'boxscore': link} for link in links]
+
+
+def test_iter_games_does_not_fail_a_game_over_its_shot_chart(monkeypatch):
+    def fetch_page(url, *args, **kwargs):
+        if '/shot-chart/' in url:
+            raise requests.HTTPError('404 for {0}'.format(url))
+        return url
+    monkeypatch.setattr(B, 'fetch_page', fetch_page)
+    links = ['http://example.com/boxscores/g{0}.html'.format(i) for i in range(1, 4)]
+    fetcher = B.PageFetcher(max_workers=2)
+    try:
+        games = list(fetcher.iter_games(links, shotchart=True, window=2))
+    finally:
+        fetcher.close()
+    for link, pages in games:
+        assert pages['boxscore'] == link
+        assert isinstance(pages['shotchart'], requests.HTTPError)
@@ -0,0 +1,61 @@
+import os
+import sys
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import BBRef_scrape as B
+
+GAME_ID = '200902020BOS'
+LINK = B.BOXSCORE_URL.format(GAME_ID)
+
+
+def corpus_pages():
+    pages = {}
+    for page, path in (('boxscore', ''), ('pbp', 'pbp'), ('shotchart', 'shot-chart')):
+        with open(os.path.join(ROOT, 'benchmarks', 'pages', 'boxscores', path, GAME_ID + '.html')) as f:
+            pages[page] = f.read()
+    return pages
+
+
+def not_found():
+    response = requests.Response()
+    response.status_code = 404
+    return requests.HTTPError('404 for shot chart', response=response)
+
+
+def parse(pages, validate=False):
+    return B.parse_game(LINK, pages, validate=validate, tables=list(B.BOXSCORE_TABLE_NAMES) + ['shots'])
+
+
+def test_shots_are_joined_to_the_play_by_play():
+    bundle = parse(corpus_pages())
+    assert bundle['state'] == 'parsed' and bundle['shots_error'] is None
+    assert sorted(bundle['tables']) == sorted(B.BOXSCORE_TABLE_NAMES + ('shots',))
+    assert bundle['tables']['shots']['play_id'].notna().all()
+
+
+def test_missing_shot_chart_page_means_no_shots():
+    pages = corpus_pages()
+    pages['shotchart'] = not_found()
+    bundle = parse(pages, validate=True)
+    assert bundle['state'] == 'validated' and bundle['shots_error'] is None
+    assert 'shots' not in bundle['tables'] and 'pbp' in bundle['tables']
+
+
+def test_shot_chart_fetch_error_keeps_the_box_score():
+    pages = corpus_pages()
+    pages['shotchart'] = requests.ConnectionError('connection reset')
+    bundle = parse(pages)
+    assert bundle['state'] == 'parsed' and 'connection reset' in bundle['shots_error']
+    assert sorted(bundle['tables']) == sorted(B.BOXSCORE_TABLE_NAMES)
+
+
+def test_play_by_play_error_only_loses_the_shots():
+    pages = corpus_pages()
+    pages['pbp'] = '<html><body>no play by play here</body></html>'
+    bundle = parse(pages)
+    assert bundle['state'] == 'parsed' and bundle['shots_error'] is not None
+    assert sorted(bundle['tables']) == sorted(B.BOXSCORE_TABLE_NAMES)
@@ -0,0 +1,32 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import BBRef_scrape as B
+from test_parse_game import corpus_pages, parse
+
+
+# the corpus game's play by play without the derived columns, the opening jump is followed by a home basket
+def opening_play_by_play():
+    pbp = parse(corpus_pages(), validate=True)['tables']['pbp']
+    pbp = pbp.drop(columns=['possession_id', 'offense_team_id'])
+    pbp = pbp[pbp['event_type'] != 'turnover'].reset_index(drop=True)
+    assert list(pbp['event_type'][:4]) == ['Start period', 'Jump', '2pt', 'Defensive rebound']
+    return pbp
+
+
+def test_jump_ball_goes_to_the_team_that_gains_it():
+    pbp = opening_play_by_play()
+    pbp.loc[pbp['event_type'] == 'Jump', 'Possession'] = pbp['A1'][0]
+    tagged, possessions = B.get_possessions(pbp)
+    assert list(possessions['offense_team_id'][:2]) == [14, 2]
+
+
+def test_jump_ball_without_a_winner_leaves_the_possession_open():
+    for winner in (None, 'nobody'):
+        pbp = opening_play_by_play()
+        pbp.loc[pbp['event_type'] == 'Jump', 'Possession'] = winner
+        tagged, possessions = B.get_possessions(pbp)
+        assert possessions['offense_team_id'][0] == 2
+        assert (tagged['offense_team_id'][:3] == 2).all()
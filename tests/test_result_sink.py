@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BBRef_scrape as B
+
+
+# every default table, only finalScores has rows
+def scores(game_id):
+    tables = dict((name, pd.DataFrame()) for name in B.BOXSCORE_TABLE_NAMES)
+    tables['finalScores'] = pd.DataFrame({'game_id': [game_id, game_id], 'team_id': [0, 1], 'T': [99, 101]})
+    return tables
+
+
+# writes g2's rows to the part files but dies before the manifest is rewritten
+def crash_after_part_write(directory, part_rows):
+    sink = B.ResultSink(directory, batch_games=1, part_rows=part_rows)
+    sink.write_game('g1', scores('g1'))
+    for name, frame in scores('g2').items():
+        sink.table(name).append(frame)
+    for table in sink.tables.values():
+        table.flush()
+
+
+def rerun(directory, part_rows):
+    sink = B.ResultSink(directory, batch_games=1, part_rows=part_rows)
+    assert sink.games() == {'g1'}
+    sink.write_game('g2', scores('g2'))
+    sink.close()
+    return B.ResultSink(directory, batch_games=1, part_rows=part_rows).read('finalScores')
+
+
+def test_restart_does_not_duplicate_rows_appended_before_a_crash(tmp_path):
+    crash_after_part_write(str(tmp_path), part_rows=100)
+    frame = rerun(str(tmp_path), part_rows=100)
+    assert list(frame['game_id']) == ['g1', 'g1', 'g2', 'g2']
+
+
+def test_restart_overwrites_a_part_started_before_a_crash(tmp_path):
+    crash_after_part_write(str(tmp_path), part_rows=2)
+    frame = rerun(str(tmp_path), part_rows=2)
+    assert list(frame['game_id']) == ['g1', 'g1', 'g2', 'g2']
@@ -0,0 +1,119 @@
+import json
+import os
+import sys
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BBRef_scrape as B
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'pages')
+
+
+def corpus_links():
+    with open(os.path.join(CORPUS_DIR, 'corpus.json')) as f:
+        return [B.BOXSCORE_URL.format(game['game_id']) for game in json.load(f)['games']]
+
+
+# fetch_page stand in serving the benchmark corpus, which is laid out like the urls
+def corpus_fetch_page(url, *args, **kwargs):
+    with open(os.path.join(CORPUS_DIR, url.split('basketball-reference.com/')[1])) as f:
+        return f.read()
+
+
+def scrape(directory, links, **kwargs):
+    sink = B.ResultSink(os.path.join(directory, 'results'))
+    ledger = B.JobLedger(os.path.join(directory, 'jobs.db'))
+    fetcher = B.PageFetcher(max_workers=2)
+    try:
+        B.run_scrape(links, sink, ledger, fetcher, parse_workers=0, **kwargs)
+        return dict((link, ledger.state(link)) for link in links), sink.read('playerStats')
+    finally:
+        ledger.close()
+        fetcher.close()
+
+
+def test_plain_run_after_validate_run_keeps_validated_games(monkeypatch, tmp_path):
+    monkeypatch.setattr(B, 'fetch_page', corpus_fetch_page)
+    links = corpus_links()
+    states, players = scrape(str(tmp_path), links, validate=True)
+    assert set(states.values()) == {'validated'}
+    states, again = scrape(str(tmp_path), links)
+    assert set(states.values()) == {'validated'}
+    assert len(again) == len(players)
+    states, again = scrape(str(tmp_path), links, validate=True)
+    assert set(states.values()) == {'validated'}
+    assert len(again) == len(players)
+
+
+def test_plain_run_then_validate_run_validates_parsed_games(monkeypatch, tmp_path):
+    monkeypatch.setattr(B, 'fetch_page', corpus_fetch_page)
+    links = corpus_links()
+    states, players = scrape(str(tmp_path), links)
+    assert set(states.values()) == {'parsed'}
+    states, again = scrape(str(tmp_path), links, validate=True)
+    assert set(states.values()) == {'validated'}
+    assert len(again) == len(players)
+
+
+def test_retried_games_do_not_write_their_box_scores_twice(monkeypatch, tmp_path):
+    monkeypatch.setattr(B, 'fetch_page', corpus_fetch_page)
+    links = corpus_links()
+    compare_boxscores = B.compare_boxscores
+    failing = set(B.url_to_id(link) for link in links[:2])
+
+    # the first two games don't match their play by play on the first run
+    def mismatch(players, pbpbs):
+        fail = compare_boxscores(players, pbpbs)
+        if players['game_id'].iloc[0] in failing:
+            return players.head(1)
+        return fail
+    monkeypatch.setattr(B, 'compare_boxscores', mismatch)
+    states, players = scrape(str(tmp_path), links, validate=True)
+    assert [states[link] for link in links] == ['failed', 'failed', 'validated', 'validated', 'validated']
+    failing.clear()
+    states, again = scrape(str(tmp_path), links, validate=True, retry_failed=True)
+    assert set(states.values()) == {'validated'}
+    assert len(again) == len(players)
+    sink = B.ResultSink(os.path.join(str(tmp_path), 'results'))
+    assert sorted(sink.read('pbp')['game_id'].unique()) == sorted(B.url_to_id(link) for link in links)
+
+
+def test_tables_backfill_does_not_count_games_as_stored(monkeypatch, tmp_path):
+    monkeypatch.setattr(B, 'fetch_page', corpus_fetch_page)
+    links = corpus_links()
+    directory = str(tmp_path)
+    scrape(directory, links, tables=['finalScores'])
+    sink = B.ResultSink(os.path.join(directory, 'results'))
+    assert sink.games() == set()
+    assert B.missing_games(B.pd.DataFrame({'game_id': [B.url_to_id(link) for link in links], 'url': links}),
+                           sink.games()) == links
+    os.remove(os.path.join(directory, 'jobs.db'))
+    states, players = scrape(directory, links)
+    assert set(states.values()) == {'parsed'}
+    sink = B.ResultSink(os.path.join(directory, 'results'))
+    assert sink.games() == set(B.url_to_id(link) for link in links)
+    assert len(sink.read('finalScores')) == 2 * len(links)
+
+
+def test_game_without_tables_is_still_marked_done(monkeypatch, tmp_path):
+    def fetch_page(url, *args, **kwargs):
+        if '/shot-chart/' in url:
+            response = requests.Response()
+            response.status_code = 404
+            raise requests.HTTPError('404 for {0}'.format(url), response=response)
+        return corpus_fetch_page(url)
+    monkeypatch.setattr(B, 'fetch_page', fetch_page)
+    links = corpus_links()
+    fetched = []
+    iter_games = B.PageFetcher.iter_games
+
+    def counting_iter_games(self, links, *args, **kwargs):
+        fetched.extend(links)
+        return iter_games(self, links, *args, **kwargs)
+    monkeypatch.setattr(B.PageFetcher, 'iter_games', counting_iter_games)
+    states, _ = scrape(str(tmp_path), links, tables=['shots'])
+    assert set(states.values()) == {'parsed'}
+    scrape(str(tmp_path), links, tables=['shots'])
+    assert fetched == links
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BBRef_scrape as B
+
+
+def final_scores():
+    return pd.DataFrame({'game_id': [None, None], 'team_id': [14, 2], '1': [20.0, 10.0], '2': [15.0, 20.0],
+                         '3': [15.0, 12.0], '4': [16.0, 15.0], 'OT': [0, 0], 'T': [66.0, 57.0], '#OT': [0, 0],
+                         'H/A': [0, 1]})
+
+
+# every default table, the ones the games row isn't built from are left empty
+def full_bundle():
+    tables = dict((name, pd.DataFrame()) for name in B.BOXSCORE_TABLE_NAMES)
+    tables['finalScores'] = final_scores()
+    tables['gameLengths'] = pd.DataFrame({'game_id': [None], 'GameLength': ['2:28']})
+    return tables
+
+
+def test_partial_bundle_keeps_the_stored_game_length(tmp_path):
+    url = 'sqlite:///' + str(tmp_path / 'games.db')
+    store = B.SqlStore(url)
+    store.write_game('200902020BOS', full_bundle())
+    store.close()
+    store = B.SqlStore(url)
+    store.write_game('200902020BOS', {'finalScores': final_scores()})
+    store.close()
+    with B.create_engine(url).connect() as conn:
+        rows = conn.execute(B.text('SELECT * FROM games')).fetchall()
+    assert [tuple(r) for r in rows] == [('200902020BOS', 2, 14, 57.0, 66.0, 0, '2:28')]
+
+
+def test_partial_bundle_does_not_mark_a_new_game_stored(tmp_path):
+    url = 'sqlite:///' + str(tmp_path / 'games.db')
+    store = B.SqlStore(url)
+    store.write_game('200902020BOS', {'finalScores': final_scores()})
+    assert store.games() == set()
+    store.close()
+    store = B.SqlStore(url)
+    assert store.games() == set()
+    store.write_game('200902020BOS', full_bundle())
+    assert store.games() == {'200902020BOS'}
+    store.close()
+    assert B.SqlStore(url).games() == {'200902020BOS'}